@@ -0,0 +1,147 @@
+"""Compares the hit ratios of transient cache eviction policies on access
+traces.
+
+Traces are sequences of keys.  They may be recorded to a text file with one key
+per line and passed on the command line; otherwise a set of synthetic traces
+is generated, including a scan-heavy trace modelled on systematic variation
+sweeps, in which a small set of hot nominal keys is interleaved with long
+passes over many one-off variation keys.
+
+Usage:
+
+    python benchmarks/eviction_hit_ratio.py [capacity] [trace_file ...]
+"""
+
+
+# System imports
+import sys
+import random
+
+# owls-cache imports
+from owls_cache.transient.policies import POLICIES, create_policy
+
+
+def simulate(policy, trace, capacity):
+    """Replays a trace against a cache of fixed capacity.
+
+    Args:
+        policy: The policy name
+        trace: The sequence of keys
+        capacity: The maximum number of entries in the cache
+
+    Returns:
+        The hit ratio.
+    """
+    # Create the policy and the set of resident keys
+    policy = create_policy(policy)
+    policy.capacity = capacity
+    resident = set()
+
+    # Replay the trace
+    hits = 0
+    for key in trace:
+        if key in resident:
+            hits += 1
+            policy.access(key)
+            continue
+        while len(resident) >= capacity:
+            resident.remove(policy.evict(key))
+        policy.insert(key)
+        resident.add(key)
+
+    # All done
+    return hits / float(len(trace))
+
+
+def scan_trace(length, hot = 50, variations = 2000, seed = 0):
+    """Generates a scan-heavy trace of hot nominal keys interleaved with
+    sweeps over systematic variations.
+
+    Args:
+        length: The number of accesses
+        hot: The number of hot keys
+        variations: The number of keys in each sweep
+        seed: The random seed
+
+    Returns:
+        The trace, as a list of keys.
+    """
+    generator = random.Random(seed)
+    trace = []
+    sweep = 0
+    while len(trace) < length:
+        # Access the hot keys for a while
+        for _ in range(4 * hot):
+            trace.append('nominal-{0}'.format(generator.randrange(hot)))
+
+        # Then sweep over a set of variations
+        for i in range(variations // 10):
+            trace.append('variation-{0}-{1}'.format(sweep, i))
+        sweep += 1
+    return trace[:length]
+
+
+def zipf_trace(length, keys = 5000, exponent = 1.0, seed = 0):
+    """Generates a trace with Zipf-distributed key popularity.
+
+    Args:
+        length: The number of accesses
+        keys: The number of distinct keys
+        exponent: The Zipf exponent
+        seed: The random seed
+
+    Returns:
+        The trace, as a list of keys.
+    """
+    generator = random.Random(seed)
+    weights = [1.0 / (i + 1) ** exponent for i in range(keys)]
+    return generator.choices(range(keys), weights = weights, k = length)
+
+
+def loop_trace(length, keys = 120):
+    """Generates a trace which loops over a fixed set of keys.
+
+    Args:
+        length: The number of accesses
+        keys: The number of keys in the loop
+
+    Returns:
+        The trace, as a list of keys.
+    """
+    return [i % keys for i in range(length)]
+
+
+def main(capacity = 100, *trace_files):
+    """Runs the benchmark and prints a table of results.
+
+    Args:
+        capacity: The cache capacity, in entries
+        trace_files: Paths to recorded traces, one key per line
+    """
+    # Load or generate traces
+    if trace_files:
+        traces = []
+        for path in trace_files:
+            with open(path) as f:
+                traces.append((path, [l.rstrip('\n') for l in f]))
+    else:
+        traces = [
+            ('scan', scan_trace(100000)),
+            ('zipf', zipf_trace(100000)),
+            ('loop', loop_trace(100000)),
+        ]
+
+    # Print the results
+    policies = sorted(POLICIES)
+    print('{0:>12} '.format('trace') +
+          ' '.join('{0:>10}'.format(p) for p in policies))
+    for name, trace in traces:
+        print('{0:>12} '.format(name) + ' '.join(
+            '{0:>10.4f}'.format(simulate(p, trace, capacity))
+            for p in policies
+        ))
+
+
+# Run the benchmark if this is the main module
+if __name__ == '__main__':
+    main(*([int(a) for a in sys.argv[1:2]] + sys.argv[2:]))
@@ -0,0 +1,119 @@
+"""Measures the throughput and size ratio of persistent cache serializer
+configurations on representative payloads.
+
+Payloads include a small dictionary of scalars, a large list of floats, a
+large dictionary of histogram-like records, and (if NumPy is available) a large
+numeric array.  For each payload and serializer configuration, the script
+reports serialization and deserialization throughput (in MB/s of pickled
+data) and the ratio of serialized size to plain pickle size.
+
+Usage:
+
+    python benchmarks/serialization.py [repetitions]
+"""
+
+
+# System imports
+import sys
+import pickle
+import random
+import time
+
+# owls-cache imports
+from owls_cache.persistent.serializers import PickleSerializer
+
+
+# The serializer configurations to measure
+CONFIGURATIONS = [
+    ('protocol 2', {'protocol': 2}),
+    ('highest', {}),
+    ('out-of-band', {'out_of_band': True}),
+    ('zlib', {'compression': 'zlib'}),
+    ('zlib-1', {'compression': 'zlib', 'level': 1}),
+    ('bz2', {'compression': 'bz2'}),
+    ('lzma', {'compression': 'lzma'}),
+    ('out-of-band+zlib', {'out_of_band': True, 'compression': 'zlib'}),
+]
+
+
+def payloads():
+    """Creates the representative payloads.
+
+    Returns:
+        A list of tuples of the form (name, value).
+    """
+    generator = random.Random(0)
+    result = [
+        ('scalars', {'count': 123, 'mean': 4.5, 'name': 'nominal'}),
+        ('floats', [generator.gauss(0, 1) for _ in range(200000)]),
+        ('histograms', dict(
+            ('region_{0}'.format(i), {
+                'edges': [float(e) for e in range(101)],
+                'counts': [generator.randrange(1000) for _ in range(100)],
+            })
+            for i in range(500)
+        )),
+    ]
+    try:
+        import numpy
+        result.append((
+            'array',
+            numpy.random.RandomState(0).normal(size = (1000, 1000))
+        ))
+    except ImportError:
+        pass
+    return result
+
+
+def measure(serializer, value, repetitions):
+    """Measures a serializer on a value.
+
+    Args:
+        serializer: The serializer
+        value: The value
+        repetitions: The number of repetitions
+
+    Returns:
+        A tuple of the form (serialized size, dump seconds, load seconds),
+        with times being the best of all repetitions.
+    """
+    dump_time = load_time = float('inf')
+    for _ in range(repetitions):
+        start = time.perf_counter()
+        data = serializer.dumps(value)
+        dump_time = min(dump_time, time.perf_counter() - start)
+        start = time.perf_counter()
+        serializer.loads(data)
+        load_time = min(load_time, time.perf_counter() - start)
+    return len(data), dump_time, load_time
+
+
+def main(repetitions = 3):
+    """Runs the benchmark and prints a table of results.
+
+    Args:
+        repetitions: The number of repetitions of each measurement
+    """
+    print('{0:>12} {1:>18} {2:>10} {3:>10} {4:>8}'.format(
+        'payload', 'configuration', 'dump MB/s', 'load MB/s', 'ratio'
+    ))
+    for name, value in payloads():
+        reference = len(pickle.dumps(value, protocol = 2))
+        for configuration, options in CONFIGURATIONS:
+            size, dump_time, load_time = measure(
+                PickleSerializer(**options),
+                value,
+                repetitions
+            )
+            print('{0:>12} {1:>18} {2:>10.1f} {3:>10.1f} {4:>8.3f}'.format(
+                name,
+                configuration,
+                reference / dump_time / 1e6,
+                reference / load_time / 1e6,
+                size / float(reference)
+            ))
+
+
+# Run the benchmark if this is the main module
+if __name__ == '__main__':
+    main(*[int(a) for a in sys.argv[1:2]])
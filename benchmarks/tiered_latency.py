@@ -0,0 +1,107 @@
+"""Measures the hit-path latency of a tiered cache (an in-process memory tier
+over redis) compared with a bare redis backend.
+
+The script stores a few representative values, then repeatedly reads them back
+through each backend, reporting the median and 99th percentile latency of a
+cache hit.  It uses the redis server on localhost:6379 if one is available,
+and otherwise the in-process stand-in server from the test suite (in which
+case the network cost is that of the loopback interface).
+
+Usage:
+
+    python benchmarks/tiered_latency.py [reads]
+"""
+
+
+# System imports
+from os.path import abspath, dirname, join
+import sys
+import time
+
+# owls-cache imports
+from owls_cache.persistent.caches.redis import RedisPersistentCache
+from owls_cache.persistent.caches.tiered import TieredPersistentCache
+
+
+# The values to store
+VALUES = [
+    ('scalar', 42),
+    ('record', {'edges': list(range(101)), 'counts': [7] * 100}),
+    ('floats', [float(i) for i in range(100000)]),
+]
+
+
+def connect():
+    """Connects to a redis server, starting the stand-in server if necessary.
+
+    Returns:
+        A RedisPersistentCache instance.
+    """
+    backend = RedisPersistentCache(prefix = 'benchmark')
+    try:
+        backend.get('dummy')
+        return backend
+    except Exception:
+        pass
+    sys.path.insert(0, join(dirname(dirname(abspath(__file__))), 'testing'))
+    from redis_standin import RedisStandIn
+    server = RedisStandIn().start()
+    print('using the in-process redis stand-in')
+    return RedisPersistentCache(port = server.port, prefix = 'benchmark')
+
+
+def measure(backend, key, reads):
+    """Measures the latency of cache hits for a key.
+
+    Args:
+        backend: The backend
+        key: The key, which must be present
+        reads: The number of reads
+
+    Returns:
+        A tuple of the form (median latency, 99th percentile latency), in
+        seconds.
+    """
+    latencies = []
+    for _ in range(reads):
+        start = time.perf_counter()
+        backend.get(key)
+        latencies.append(time.perf_counter() - start)
+    latencies.sort()
+    return latencies[len(latencies) // 2], \
+        latencies[min(int(len(latencies) * 0.99), len(latencies) - 1)]
+
+
+def main(reads = 1000):
+    """Runs the benchmark and prints a table of results.
+
+    Args:
+        reads: The number of reads of each value through each backend
+    """
+    # Create the backends and store the values
+    redis_backend = connect()
+    backends = [
+        ('redis', redis_backend),
+        ('tiered', TieredPersistentCache(redis_backend)),
+    ]
+    for key, value in VALUES:
+        redis_backend.set(key, value)
+
+    # Measure the latencies
+    print('{0:>8} {1:>8} {2:>12} {3:>12}'.format(
+        'value', 'backend', 'median us', 'p99 us'
+    ))
+    for key, _ in VALUES:
+        for name, backend in backends:
+            median, tail = measure(backend, key, reads)
+            print('{0:>8} {1:>8} {2:>12.1f} {3:>12.1f}'.format(
+                key,
+                name,
+                median * 1e6,
+                tail * 1e6
+            ))
+
+
+# Run the benchmark if this is the main module
+if __name__ == '__main__':
+    main(*[int(a) for a in sys.argv[1:2]])
@@ -0,0 +1,101 @@
+"""Measures the throughput of transiently-cached functions under thread
+contention.
+
+Each thread performs a fixed number of calls drawn from a small key space, so
+the workload is dominated by cache hits with occasional (coalesced) misses.
+The script reports the aggregate call throughput and the number of underlying
+function invocations for an increasing number of threads.
+
+Usage:
+
+    python benchmarks/transient_contention.py [calls_per_thread]
+"""
+
+
+# System imports
+import sys
+import threading
+import random
+import time
+
+# owls-cache imports
+from owls_cache.transient import cached
+
+
+# The number of distinct keys in the workload
+KEYS = 64
+
+# The size of the cache (smaller than the key space to force evictions)
+CACHE_SIZE = 48
+
+# The thread counts to measure
+THREAD_COUNTS = (1, 2, 4, 8, 16)
+
+
+def run(thread_count, calls_per_thread):
+    """Runs the contention workload.
+
+    Args:
+        thread_count: The number of threads to use
+        calls_per_thread: The number of cached calls to make on each thread
+
+    Returns:
+        A tuple of the form (calls per second, underlying invocations).
+    """
+    # Create a fresh cached function
+    invocations = [0]
+
+    @cached()
+    def compute(x):
+        invocations[0] += 1
+        time.sleep(0.0005)
+        return x * x
+
+    # Create a deterministic key sequence for each thread
+    sequences = [
+        [random.Random(i * calls_per_thread + j).randrange(KEYS)
+         for j in range(calls_per_thread)]
+        for i in range(thread_count)
+    ]
+
+    # Create the workers
+    barrier = threading.Barrier(thread_count + 1)
+    def worker(sequence):
+        barrier.wait()
+        for x in sequence:
+            compute(x, cache_size = CACHE_SIZE)
+    threads = [threading.Thread(target = worker, args = (s,))
+               for s in sequences]
+    for t in threads:
+        t.start()
+
+    # Time the workload
+    barrier.wait()
+    start = time.perf_counter()
+    for t in threads:
+        t.join()
+    elapsed = time.perf_counter() - start
+
+    # All done
+    return (thread_count * calls_per_thread / elapsed, invocations[0])
+
+
+def main(calls_per_thread = 20000):
+    """Runs the benchmark and prints a table of results.
+
+    Args:
+        calls_per_thread: The number of cached calls to make on each thread
+    """
+    print('{0:>8} {1:>14} {2:>12}'.format('threads', 'calls/s', 'invocations'))
+    for thread_count in THREAD_COUNTS:
+        throughput, invocations = run(thread_count, calls_per_thread)
+        print('{0:>8} {1:>14.0f} {2:>12}'.format(
+            thread_count,
+            throughput,
+            invocations
+        ))
+
+
+# Run the benchmark if this is the main module
+if __name__ == '__main__':
+    main(*[int(a) for a in sys.argv[1:2]])
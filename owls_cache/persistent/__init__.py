@@ -2,9 +2,14 @@
 import threading
 from six import iteritems
 from functools import wraps
+from collections import OrderedDict
 from contextlib import contextmanager
 import logging
 
+# owls-cache imports
+from owls_cache.stats import CacheStatistics
+from owls_cache.persistent.keys import compute_key
+
 
 # Global persistent caching logger (with debug disabled by default)
 _cache_log = logging.getLogger(__name__)
@@ -33,8 +38,36 @@ _get_cache = lambda: getattr(_thread_local, 'cache', None)
 _set_cache = lambda cache: setattr(_thread_local, 'cache', cache)
 
 
+def _identifier_key(name, identifier):
+    """Computes the cache key for an identifier.
+
+    Args:
+        name: The name of the cached callable
+        identifier: The identifier tuple produced by the mapper
+
+    Returns:
+        A tuple of the form (key, state).
+    """
+    # Compute the combined state of the identifiers
+    # TODO: Provide all identifiers to call to iden.state(); this
+    # would allow changing MC sample weights without affecting the
+    # data samples.
+    def identifier_or_state(iden):
+        state = getattr(iden, 'state', None)
+        return state() if callable(state) else iden
+    state = tuple((identifier_or_state(i) for i in identifier))
+
+    # Compute the cache key
+    try:
+        return compute_key(name, state), state
+    except:
+        _cache_log.error('Failed to compute key for %s', state)
+        raise
+
+
 def cached(name,
-           mapper = lambda *args, **kwargs: args + tuple(iteritems(kwargs))):
+           mapper = lambda *args, **kwargs: args + tuple(iteritems(kwargs)),
+           ttl = None):
     """Creates a persistently-cached version of a function.
 
     If there is no cache associated with the current thread's context, then no
@@ -44,18 +77,35 @@ def cached(name,
         name: A unique name by which to refer to the callable in the persistent
             cache
         mapper: A function which accepts the same arguments as the underlying
-            function and maps them to a hashable tuple of values, which will
-            then be hashed to act as the cache key.  If the argument types to
-            the underlying function are not hashable (e.g. they are lists or
-            dictionaries), then this function provides a mechanism by which to
-            convert them to hashable types (e.g. tuples).  Defaults to a
-            function which concatenates args and kwargs into a tuple.
+            function and maps them to a tuple of values, whose state will then
+            be canonically encoded and digested to act as the cache key (see
+            `owls_cache.persistent.keys`).  Values may be primitive types,
+            containers thereof, or objects providing a `state()` method.
+            Defaults to a function which concatenates args and kwargs into a
+            tuple.
+        ttl: The time-to-live of cached values in seconds, or None (the
+            default) to use the backend's default.  Only supported by
+            backends with expiry (e.g. RedisPersistentCache).
 
     Returns:
-        A cached version of the callable.
+        A cached version of the callable.  It has a `statistics` attribute,
+        which is a CacheStatistics instance recording hits, misses, and
+        computation times for the callable.  Backend-level statistics (e.g.
+        get/set latencies) are available from the `statistics` attribute of
+        the backend.  It also has a `batch` method, which accepts an iterable
+        of positional argument tuples and returns the list of corresponding
+        results, using a single batched backend lookup, and an `invalidate`
+        method, which invalidates all of the callable's values in the current
+        thread's cache (if the backend supports invalidation).
     """
+    # Create the options passed to the backend when storing values
+    options = {} if ttl is None else {'ttl': ttl}
+
     # Create the decorator
     def decorator(f):
+        # Create the statistics for the function
+        statistics = CacheStatistics()
+
         # Create the wrapper function
         @wraps(f)
         def wrapper(*args, **kwargs):
@@ -67,56 +117,97 @@ def cached(name,
 
             # Check if caching is disabled
             if cache is None:
-                _cache_log.debug('caching disabled for {0} in {1}'.format(
+                _cache_log.debug(
+                    'caching disabled for %s in %s',
                     identifier,
                     name
-                ))
+                )
                 return f(*args, **kwargs)
 
-            # Compute the combined state of the identifiers
-            # TODO: Provide all identifiers to call to iden.state(); this
-            # would allow changing MC sample weights without affecting the
-            # data samples.
-            def identifier_or_state(iden):
-                try:
-                    return iden.state()
-                except:
-                    return iden
-            state = tuple((identifier_or_state(i) for i in identifier))
-
             # Compute the cache key
-            try:
-                key = hash((name, identifier))
-            except:
-                _cache_log.error('Failed to hash {0}'.format(state))
-                raise
+            key, state = _identifier_key(name, identifier)
 
             # Check if we have a cache hit
             result = cache.get(key)
             if result is not None:
                 # NOTE: Cache hits are almost always irrelevant. It's the
                 # misses we're after.
-                #_cache_log.debug('cache hit for {0} in {1}'.format(
-                    #state,
-                    #name
-                #))
+                statistics.count('hits')
                 return result
 
             # Log the cache miss
-            _cache_log.debug('cache miss for {0} in {1}'.format(
-                state,
-                name
-            ))
+            statistics.count('misses')
+            _cache_log.debug('cache miss for %s in %s', state, name)
 
             # If not, do the hard work
-            result = f(*args, **kwargs)
+            with statistics.timing('compute'):
+                result = f(*args, **kwargs)
 
             # Cache the value
-            cache.set(key, result)
+            cache.set(key, result, **options)
 
             # All done
             return result
 
+        # Create the batched version of the wrapper
+        def batch(calls):
+            """Calls the cached function for many sets of positional
+            arguments, resolving all of them with a single batched lookup in
+            the backend and storing all computed values with a single batched
+            store.
+
+            Args:
+                calls: An iterable of argument tuples
+
+            Returns:
+                A list of results, in the same order as the calls.
+            """
+            # Get the cache
+            calls = [tuple(c) for c in calls]
+            cache = _get_cache()
+
+            # Check if caching is disabled
+            if cache is None:
+                return [f(*c) for c in calls]
+
+            # Compute the cache keys and look them all up at once
+            keys = [_identifier_key(name, mapper(*c))[0] for c in calls]
+            results = cache.get_many(keys)
+
+            # Compute the misses, only computing each distinct key once
+            computed = OrderedDict()
+            for i, (call, key) in enumerate(zip(calls, keys)):
+                if results[i] is not None:
+                    statistics.count('hits')
+                    continue
+                if key not in computed:
+                    statistics.count('misses')
+                    _cache_log.debug('cache miss for %s in %s', call, name)
+                    with statistics.timing('compute'):
+                        computed[key] = f(*call)
+                results[i] = computed[key]
+
+            # Store the computed values
+            if computed:
+                cache.set_many(computed, **options)
+
+            # All done
+            return results
+
+        # Create the invalidation function
+        def invalidate():
+            """Invalidates all values of the cached function in the current
+            thread's cache, if any.
+            """
+            cache = _get_cache()
+            if cache is not None:
+                cache.invalidate(name)
+
+        # Set the statistics, batch, and invalidation attributes
+        wrapper.statistics = statistics
+        wrapper.batch = batch
+        wrapper.invalidate = invalidate
+
         # Return the wrapper function
         return wrapper
 
@@ -135,14 +226,21 @@ def caching_into(cache):
         with caching_into(my_cache):
             # Do operations....
 
+    On exit, the cache is flushed, so that any deferred stores (e.g. those
+    queued by a WriteBehindPersistentCache) are written before execution
+    continues.
+
     Args:
         cache: The persistent cache to use
     """
     # Set the cache
     _set_cache(cache)
 
-    # Let code run
-    yield
-
-    # All done
-    _set_cache(None)
+    # Let code run, flushing the cache when done
+    try:
+        yield
+    finally:
+        try:
+            cache.flush()
+        finally:
+            _set_cache(None)
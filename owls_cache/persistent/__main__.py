@@ -0,0 +1,102 @@
+"""Provides command line maintenance operations for persistent caches.
+
+Usage:
+
+    python -m owls_cache.persistent gc [--path PATH] [--max-bytes SIZE]
+        [--max-entries COUNT] [--eviction {lru,cost}]
+"""
+
+
+# System imports
+from argparse import ArgumentParser
+import sys
+
+# owls-cache imports
+from owls_cache.persistent.caches.fs import FileSystemPersistentCache
+
+
+# Multipliers for size suffixes
+_SIZE_SUFFIXES = {
+    'K': 1 << 10,
+    'M': 1 << 20,
+    'G': 1 << 30,
+    'T': 1 << 40,
+}
+
+
+def parse_size(value):
+    """Parses a size in bytes, with an optional K, M, G, or T (binary) suffix.
+
+    Args:
+        value: The size string, e.g. '512M'
+
+    Returns:
+        The size in bytes.
+    """
+    value = value.strip().upper().rstrip('B')
+    if value and value[-1] in _SIZE_SUFFIXES:
+        return int(float(value[:-1]) * _SIZE_SUFFIXES[value[-1]])
+    return int(value)
+
+
+def gc(arguments):
+    """Trims a file system cache directory.
+
+    Args:
+        arguments: The parsed command line arguments
+    """
+    cache = FileSystemPersistentCache(
+        arguments.path,
+        eviction = arguments.eviction
+    )
+    removed, freed = cache.gc(arguments.max_bytes, arguments.max_entries)
+    print('removed {0} entries ({1} bytes)'.format(removed, freed))
+
+
+def main(argv = None):
+    """Runs the command line interface.
+
+    Args:
+        argv: The command line arguments (excluding the program name), or None
+            to use sys.argv
+    """
+    # Create the parser
+    parser = ArgumentParser(prog = 'python -m owls_cache.persistent')
+    commands = parser.add_subparsers(dest = 'command')
+    commands.required = True
+
+    # Add the gc command
+    gc_parser = commands.add_parser(
+        'gc',
+        help = 'trim a file system cache to a quota'
+    )
+    gc_parser.add_argument(
+        '--path',
+        help = 'the cache directory (defaults to ~/.owls-cache)'
+    )
+    gc_parser.add_argument(
+        '--max-bytes',
+        type = parse_size,
+        help = 'the maximum total size of entries (e.g. 20G)'
+    )
+    gc_parser.add_argument(
+        '--max-entries',
+        type = int,
+        help = 'the maximum number of entries'
+    )
+    gc_parser.add_argument(
+        '--eviction',
+        choices = ('lru', 'cost'),
+        default = 'lru',
+        help = 'the eviction policy (defaults to lru)'
+    )
+    gc_parser.set_defaults(handler = gc)
+
+    # Run the command
+    arguments = parser.parse_args(argv)
+    arguments.handler(arguments)
+
+
+# Run the command line interface if this is the main module
+if __name__ == '__main__':
+    main(sys.argv[1:])
@@ -2,19 +2,50 @@
 """
 
 
-# System imports
-from collections import OrderedDict
+# Six imports
+from six import iteritems
+
+# owls-cache imports
+from owls_cache.stats import CacheStatistics
 
 
 class PersistentCache(object):
     """The base caching backend.  This backend should be subclassed by concrete
     implementations.
+
+    Implementations should record their activity in the `statistics`
+    attribute, including get/set latencies and the number of bytes read and
+    written.
     """
 
+    @property
+    def statistics(self):
+        """The CacheStatistics instance for the backend, created on first use.
+        """
+        # NOTE: This is created lazily (rather than in an initializer) so that
+        # subclasses need not chain initializers
+        statistics = self.__dict__.get('_statistics')
+        if statistics is None:
+            statistics = self.__dict__.setdefault(
+                '_statistics',
+                CacheStatistics()
+            )
+        return statistics
+
+    def __getstate__(self):
+        """Returns a reconstructable state for pickling, excluding statistics.
+        """
+        state = self.__dict__.copy()
+        state.pop('_statistics', None)
+        return state
+
     def set(self, key, value):
         """Sets the cache value for a given key, overwriting any previous
         value set for that key.
 
+        Backends supporting expiry additionally accept a `ttl` keyword
+        argument specifying the entry's time-to-live in seconds.
+
         Args:
             key: The (string) key to update
             value: The (object) value to set
@@ -31,3 +62,56 @@ class PersistentCache(object):
             The associated value, or None if the key is not found.
         """
         raise NotImplementedError('abstract method')
+
+    def flush(self):
+        """Waits until all stores made through this backend are durable in
+        the underlying storage.
+
+        The default implementation does nothing.  Backends which defer stores
+        should override this method.
+        """
+        pass
+
+    def invalidate(self, name = None):
+        """Invalidates all entries for a cached callable name, or all entries
+        in the cache.
+
+        Backends which support invalidation should override this method.
+
+        Args:
+            name: The cached callable name, or None (the default) to
+                invalidate all entries
+        """
+        raise NotImplementedError('invalidation not supported by backend')
+
+    def get_many(self, keys):
+        """Gets the cache values for many keys.
+
+        The default implementation calls `get` for each key.  Backends which
+        support batched lookups should override this method.
+
+        Args:
+            keys: An iterable of keys to locate
+
+        Returns:
+            A list of the associated values, in the same order as the keys,
+            with None for keys which are not found.
+        """
+        return [self.get(key) for key in keys]
+
+    def set_many(self, items, **options):
+        """Sets the cache values for many keys, overwriting any previous values
+        set for those keys.
+
+        The default implementation calls `set` for each key.  Backends which
+        support batched stores should override this method.
+
+        Args:
+            items: A dictionary or an iterable of (key, value) pairs
+            options: Additional backend-specific options (e.g. `ttl`) passed
+                to `set`
+        """
+        if isinstance(items, dict):
+            items = iteritems(items)
+        for key, value in items:
+            self.set(key, value, **options)
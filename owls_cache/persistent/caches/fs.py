@@ -3,21 +3,180 @@
 
 
 # System imports
-from os.path import exists, isdir, isfile, join, expanduser
-from os import makedirs
+from os.path import exists, isdir, join, expanduser
+from os import makedirs, fsync, close, fdopen, unlink, open as os_open, \
+    O_RDONLY, SEEK_END, walk, stat, utime
+from tempfile import mkstemp
+from hashlib import blake2b
+from heapq import heappush, heappop, heapify
+from itertools import count
+import threading
+import errno
+import logging
+import time
+from struct import error as StructError
+try:
+    from os import replace
+except ImportError:
+    # On POSIX systems, rename atomically replaces the destination
+    from os import rename as replace
 
 # Six imports
-from six.moves.cPickle import dump, load
+from six.moves.cPickle import UnpicklingError
+from six.moves.urllib.parse import quote
 
 # owls-cache imports
+from owls_cache.persistent import mapped
+from owls_cache.persistent.serializers import default_serializer
 from owls_cache.persistent.caches import PersistentCache
 
 
+# File system cache logger
+_fs_log = logging.getLogger(__name__)
+
+
+# The extension used for cache entry files
+_ENTRY_EXTENSION = '.cache'
+
+
+# The prefix used for temporary files
+_TEMPORARY_PREFIX = '.tmp-'
+
+
+# The age (in seconds) after which temporary files are considered abandoned
+_TEMPORARY_LIFETIME = 3600
+
+
+def _remove(path):
+    """Removes a file, ignoring files which no longer exist.
+
+    Args:
+        path: The file path
+
+    Returns:
+        True if the file was removed, False if it did not exist.
+    """
+    try:
+        unlink(path)
+        return True
+    except OSError as e:
+        if e.errno != errno.ENOENT:
+            raise
+        return False
+
+
+class _AccessIndex(object):
+    """Tracks the size and access priority of cache entries in memory, so that
+    quotas can be enforced incrementally without directory scans.
+
+    Two eviction policies are supported:
+
+        'lru': Entries are evicted in order of last access.
+        'cost': Entries are evicted according to the GreedyDual-Size
+            algorithm with uniform cost, which favors evicting large entries
+            that have not been accessed recently, maximizing the number of
+            entries (and hence hits) retained per byte.
+
+    This class is not thread-safe.
+    """
+
+    def __init__(self, policy):
+        """Initializes a new instance of the _AccessIndex class.
+
+        Args:
+            policy: The eviction policy, either 'lru' or 'cost'
+        """
+        if policy not in ('lru', 'cost'):
+            raise ValueError('invalid eviction policy: {0}'.format(policy))
+        self._policy = policy
+        self._entries = {}
+        self._heap = []
+        self._sequence = count()
+        self._inflation = 0.0
+        self.total_bytes = 0
+
+    def __len__(self):
+        """Returns the number of indexed entries.
+        """
+        return len(self._entries)
+
+    def _priority(self, size, accessed):
+        """Computes the eviction priority of an entry (lower is evicted first).
+
+        Args:
+            size: The entry size in bytes
+            accessed: The last access time of the entry
+        """
+        if self._policy == 'lru':
+            return accessed
+        return self._inflation + 1.0 / max(size, 1)
+
+    def touch(self, path, size = None, accessed = None):
+        """Records an access to (or the creation of) an entry.
+
+        Args:
+            path: The entry path
+            size: The entry size, or None to keep the recorded size (in which
+                case unknown entries are ignored)
+            accessed: The access time, or None to use the current time
+        """
+        # Determine the size
+        previous = self._entries.get(path)
+        if size is None:
+            if previous is None:
+                return
+            size = previous[0]
+        if previous is not None:
+            self.total_bytes -= previous[0]
+
+        # Update the entry
+        priority = self._priority(
+            size,
+            time.time() if accessed is None else accessed
+        )
+        self._entries[path] = (size, priority)
+        self.total_bytes += size
+        heappush(self._heap, (priority, next(self._sequence), path))
+
+        # Rebuild the heap if it's dominated by stale records
+        if len(self._heap) > 2 * len(self._entries) + 1024:
+            self._heap = [(p, next(self._sequence), e)
+                          for e, (_, p)
+                          in self._entries.items()]
+            heapify(self._heap)
+
+    def pop(self):
+        """Removes and returns the entry with the lowest priority.
+
+        Returns:
+            A tuple of the form (path, size), or None if the index is empty.
+        """
+        while self._heap:
+            priority, _, path = heappop(self._heap)
+            entry = self._entries.get(path)
+            if entry is None or entry[1] != priority:
+                continue
+            del self._entries[path]
+            self.total_bytes -= entry[0]
+            if self._policy == 'cost':
+                self._inflation = priority
+            return path, entry[0]
+        return None
+
+
 class FileSystemPersistentCache(PersistentCache):
     """Implements a persistent cache on the file system.
+
+    Entries are stored one per file in a two-level directory fan-out (e.g.
+    `ab/cd/<key>.cache`) derived from a digest of the key, so that no single
+    directory grows too large.  Entries are written to a temporary file and
+    atomically renamed into place, so concurrent readers (in any process)
+    never observe partially-written entries.
     """
 
-    def __init__(self, path = None):
+    def __init__(self, path = None, fsync = False, max_bytes = None,
+                 max_entries = None, eviction = 'lru', memory_map = False,
+                 serializer = default_serializer):
         """Initializes a new instance of the FileSystemPersistentCache.
 
         This method will raise an exception if the specified path exists and is
@@ -26,6 +185,33 @@ class FileSystemPersistentCache(PersistentCache):
         Args:
             path: The path in which to store cached items.  If None (the
                 default), `~/.owls-cache` will be used.
+            fsync: Whether or not to flush entries (and their directory) to
+                stable storage before they become visible, guaranteeing their
+                durability across system crashes at the cost of write
+                latency.  Defaults to False.
+            max_bytes: The maximum total size of entries, in bytes, or None
+                (the default) for no limit
+            max_entries: The maximum number of entries, or None (the default)
+                for no limit
+            eviction: The policy used to evict entries when a quota is
+                exceeded, either 'lru' (the default) or 'cost' (see
+                `_AccessIndex`)
+            memory_map: Whether or not to store array values (NumPy arrays
+                and memoryviews) in a raw format which is memory-mapped on
+                read (see `owls_cache.persistent.mapped`).  Values read from
+                such entries are read-only views onto the mapped file.  Other
+                values are pickled as usual.  Entries in either format can
+                always be read.  Defaults to False.
+            serializer: The Serializer instance used to serialize values (see
+                `owls_cache.persistent.serializers`).  Entries written by any
+                serializer configuration can be read.
+
+        If a quota is specified, the existing entries are scanned once when
+        the cache is first used, after which an in-memory index is maintained
+        and entries are evicted incrementally as new entries are set.  The
+        index only sees entries written by this instance, so when multiple
+        processes share a cache directory, the quota is approximate and the
+        `gc` method should be used for exact trimming.
         """
         # Use home-based path if path unavailable
         if path is None:
@@ -40,8 +226,195 @@ class FileSystemPersistentCache(PersistentCache):
             # Just pass on exceptions
             makedirs(path)
 
-        # Store the path
+        # Store the configuration
         self._path = path
+        self._fsync = fsync
+        self._max_bytes = max_bytes
+        self._max_entries = max_entries
+        self._eviction = eviction
+        self._memory_map = memory_map
+        self._serializer = serializer
+
+        # Validate the eviction policy
+        _AccessIndex(eviction)
+
+        # Create the access index lazily
+        self._index = None
+        self._index_lock = threading.Lock()
+
+    def __getstate__(self):
+        """Returns a reconstructable state for pickling.
+        """
+        state = super(FileSystemPersistentCache, self).__getstate__()
+        state['_index'] = None
+        del state['_index_lock']
+        return state
+
+    def __setstate__(self, state):
+        """Sets the object state from pickling information.
+
+        Args:
+            state: The object state
+        """
+        self.__dict__.update(state)
+        self._index_lock = threading.Lock()
+
+    def _has_quota(self):
+        """Returns whether or not a quota is configured.
+        """
+        return self._max_bytes is not None or self._max_entries is not None
+
+    def _scan(self, index, now):
+        """Scans the cache directory, populating an access index and removing
+        abandoned temporary files.
+
+        Args:
+            index: The _AccessIndex to populate
+            now: The current time
+        """
+        for directory, _, files in walk(self._path):
+            for name in files:
+                path = join(directory, name)
+                try:
+                    info = stat(path)
+                except OSError as e:
+                    if e.errno != errno.ENOENT:
+                        raise
+                    continue
+                if name.endswith(_ENTRY_EXTENSION):
+                    index.touch(path, info.st_size, info.st_mtime)
+                elif name.startswith(_TEMPORARY_PREFIX) and \
+                        now - info.st_mtime > _TEMPORARY_LIFETIME:
+                    _remove(path)
+
+    def _load_index(self):
+        """Returns the access index, building it if necessary.  The index lock
+        must be held.
+        """
+        if self._index is None:
+            index = _AccessIndex(self._eviction)
+            self._scan(index, time.time())
+            self._index = index
+        return self._index
+
+    def _trim(self, index, max_bytes, max_entries):
+        """Evicts entries until the index satisfies the specified limits.
+
+        Args:
+            index: The _AccessIndex to trim
+            max_bytes: The maximum total size, or None for no limit
+            max_entries: The maximum number of entries, or None for no limit
+
+        Returns:
+            A tuple of the form (entries removed, bytes freed).
+        """
+        removed = 0
+        freed = 0
+        while (max_bytes is not None and index.total_bytes > max_bytes) or \
+                (max_entries is not None and len(index) > max_entries):
+            victim = index.pop()
+            if victim is None:
+                break
+            if _remove(victim[0]):
+                removed += 1
+                freed += victim[1]
+        if removed:
+            self.statistics.count('evictions', removed)
+        return removed, freed
+
+    def gc(self, max_bytes = None, max_entries = None):
+        """Performs a full scan of the cache directory and trims it to the
+        specified limits, also removing abandoned temporary files.
+
+        This is suitable for offline trimming of a cache directory which may
+        have been written to by many processes.  It is also available from the
+        command line via `python -m owls_cache.persistent gc`.
+
+        Args:
+            max_bytes: The maximum total size of entries, in bytes, or None to
+                use the configured quota
+            max_entries: The maximum number of entries, or None to use the
+                configured quota
+
+        Returns:
+            A tuple of the form (entries removed, bytes freed).
+        """
+        # Use the configured limits if unspecified
+        if max_bytes is None:
+            max_bytes = self._max_bytes
+        if max_entries is None:
+            max_entries = self._max_entries
+
+        # Rebuild the index from scratch and trim it
+        with self._index_lock:
+            index = _AccessIndex(self._eviction)
+            self._scan(index, time.time())
+            result = self._trim(index, max_bytes, max_entries)
+            if self._has_quota():
+                self._index = index
+            return result
+
+    def _shard(self, key):
+        """Computes the directory in which the entry for a key is stored.
+
+        Args:
+            key: The key
+
+        Returns:
+            The directory path.
+        """
+        digest = blake2b(key.encode('utf-8'), digest_size = 2).hexdigest()
+        return join(self._path, digest[:2], digest[2:])
+
+    def _entry_path(self, key):
+        """Computes the file path of the entry for a key.
+
+        Args:
+            key: The key
+
+        Returns:
+            The file path.
+        """
+        return join(
+            self._shard(key),
+            quote(key, safe = '') + _ENTRY_EXTENSION
+        )
+
+    def _create_temporary(self, directory):
+        """Creates a temporary file for writing an entry in the specified
+        directory, creating the directory if necessary.
+
+        Args:
+            directory: The directory
+
+        Returns:
+            A tuple of the form (file descriptor, path).
+        """
+        try:
+            return mkstemp(prefix = _TEMPORARY_PREFIX, dir = directory)
+        except OSError as e:
+            if e.errno != errno.ENOENT:
+                raise
+
+        # Create the directory (tolerating concurrent creation) and retry
+        try:
+            makedirs(directory)
+        except OSError as e:
+            if e.errno != errno.EEXIST:
+                raise
+        return mkstemp(prefix = _TEMPORARY_PREFIX, dir = directory)
+
+    def _sync_directory(self, directory):
+        """Flushes a directory's entries to stable storage.
+
+        Args:
+            directory: The directory
+        """
+        descriptor = os_open(directory, O_RDONLY)
+        try:
+            fsync(descriptor)
+        finally:
+            close(descriptor)
 
     def set(self, key, value):
         """Sets the cache value for a given key, overwriting any previous
@@ -52,11 +425,40 @@ class FileSystemPersistentCache(PersistentCache):
             value: The value to set
         """
         # Compute the file path for the key
-        path = join(self._path, '{0}.pickle'.format(key))
+        path = self._entry_path(key)
+        directory = self._shard(key)
+
+        with self.statistics.timing('set'):
+            # Write the data to a temporary file
+            descriptor, temporary_path = self._create_temporary(directory)
+            try:
+                with fdopen(descriptor, 'wb') as f:
+                    if self._memory_map and mapped.is_mappable(value):
+                        mapped.write(value, f)
+                    else:
+                        self._serializer.dump(value, f)
+                    size = f.tell()
+                    self.statistics.count('bytes_written', size)
+                    if self._fsync:
+                        f.flush()
+                        fsync(f.fileno())
+
+                # Atomically move it into place
+                replace(temporary_path, path)
+            except:
+                unlink(temporary_path)
+                raise
 
-        # Open the file and write the data
-        with open(path, 'wb') as f:
-            dump(value, f, protocol = 2)
+            # Make the rename durable if requested
+            if self._fsync:
+                self._sync_directory(directory)
+
+        # Enforce the quota
+        if self._has_quota():
+            with self._index_lock:
+                index = self._load_index()
+                index.touch(path, size)
+                self._trim(index, self._max_bytes, self._max_entries)
 
     def get(self, key):
         """Gets the cache value for a given key, if any.
@@ -68,12 +470,42 @@ class FileSystemPersistentCache(PersistentCache):
             The associated value, or None if the key is not found.
         """
         # Compute the file path for the key
-        path = join(self._path, '{0}.pickle'.format(key))
+        path = self._entry_path(key)
+
+        with self.statistics.timing('get'):
+            # Try to open the entry
+            try:
+                f = open(path, 'rb')
+            except (IOError, OSError) as e:
+                if e.errno not in (errno.ENOENT, errno.EISDIR):
+                    raise
+                self.statistics.count('misses')
+                return None
+
+            # Try to load it, treating corrupt entries as misses
+            with f:
+                try:
+                    if f.read(len(mapped.MAGIC)) == mapped.MAGIC:
+                        result = mapped.read(f)
+                        f.seek(0, SEEK_END)
+                    else:
+                        f.seek(0)
+                        result = self._serializer.load(f)
+                except (EOFError, ValueError, StructError, UnpicklingError):
+                    _fs_log.warning('ignoring corrupt cache entry %s', path)
+                    self.statistics.count('misses')
+                    return None
+                self.statistics.count('bytes_read', f.tell())
 
-        # Check if it exists and whether or not it's a file
-        if not exists(path) or not isfile(path):
-            return None
+        # Record the access
+        if self._has_quota():
+            with self._index_lock:
+                self._load_index().touch(path)
+            try:
+                utime(path, None)
+            except OSError:
+                pass
 
-        # Try to load it
-        with open(path, 'rb') as f:
-            return load(f)
+        # All done
+        self.statistics.count('hits')
+        return result
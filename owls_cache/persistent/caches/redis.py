@@ -8,28 +8,84 @@ from __future__ import absolute_import
 from __future__ import print_function
 
 # System imports
-import logging
+import struct
+import threading
 
 # Six imports
 from six import iteritems
-from six.moves.cPickle import dumps, loads
 
 # redis imports
 import redis
 
 # owls-cache imports
+from owls_cache.persistent.keys import key_name
 from owls_cache.persistent.caches import PersistentCache
+from owls_cache.persistent.serializers import default_serializer
+
+
+# The magic string identifying values tagged with their generations
+_TAG_MAGIC = b'OWLSGEN\x01'
+
+
+# The format of the generation tag, as (prefix generation, name generation)
+_TAG = struct.Struct('<QQ')
+
+
+# The suffix (after the prefix) of the keys holding generation counters
+_GENERATION_KEY = '~generation'
+
+
+# Process-wide connection pools shared between RedisPersistentCache instances,
+# keyed by connection parameters
+_shared_pools = {}
+_shared_pools_lock = threading.Lock()
+
+
+def shared_connection_pool(*args, **kwargs):
+    """Returns the process-wide connection pool for a set of connection
+    parameters, creating it if necessary.
+
+    Clients using the same pool share its connections (up to the pool's
+    `max_connections` limit), rather than each holding their own.
+
+    Args: The same as the redis.StrictRedis class.
+
+    Returns:
+        The redis.ConnectionPool instance.
+    """
+    # Identify the pool by its parameters
+    identifier = repr((args, sorted(iteritems(kwargs))))
+
+    # Look up or create the pool
+    with _shared_pools_lock:
+        pool = _shared_pools.get(identifier)
+        if pool is None:
+            pool = _shared_pools[identifier] = redis.StrictRedis(
+                *args,
+                **kwargs
+            ).connection_pool
+        return pool
 
 
 class RedisPersistentCache(PersistentCache):
     """Implements a persistent cache in a redis key-value store.
+
+    Entries are namespaced by generation counters, one for the prefix and one
+    for each cached callable name (as extracted from keys generated by
+    `owls_cache.persistent.keys.compute_key`).  Each value is tagged with the
+    generations current when it was computed, and values whose tags do not
+    match the current generations are treated as misses, so the `invalidate`
+    method can drop all entries for a name or prefix by incrementing a single
+    counter, without scanning keys.  Generations are fetched in the same
+    round trip as the entries themselves.  Stale entries are overwritten when
+    recomputed, and otherwise age out if a TTL is configured.
     """
 
     def __init__(self, *args, **kwargs):
         """Initializes a new instance of the RedisPersistentCache.
 
-        Args: The same as the redis.StrictRedis class, with an additional
-            keyword argument:
+        Args: The same as the redis.StrictRedis class, with additional
+            keyword arguments:
             prefix: A prefix to append to all keys in the persistent cache.  If
                 provided, it will have a dash appended to it, so keys will be
                 of the form:
@@ -37,6 +93,19 @@ class RedisPersistentCache(PersistentCache):
                     prefix-...
 
                 If None (the default), no prefix is used.
+            serializer: The Serializer instance used to serialize values (see
+                `owls_cache.persistent.serializers`).  Values written by any
+                serializer configuration can be read.
+            shared_pool: Whether or not to use the process-wide connection
+                pool for the connection parameters (see
+                `shared_connection_pool`), so that all instances (and unpickled
+                copies) connecting to the same server share connections.  The
+                pool size can be configured with the `max_connections`
+                argument.  Defaults to False, in which case each instance has
+                its own pool.
+            ttl: The default time-to-live of entries, in seconds, or None
+                (the default) for entries which never expire.  It can be
+                overridden for individual stores (see `set`).
         """
         # Check for a prefix argument
         prefix = kwargs.pop('prefix', None)
@@ -45,17 +114,50 @@ class RedisPersistentCache(PersistentCache):
         else:
             self._prefix = '{0}-'.format(prefix)
 
+        # Check for other arguments
+        self._serializer = kwargs.pop('serializer', default_serializer)
+        self._shared_pool = kwargs.pop('shared_pool', False)
+        self._ttl = kwargs.pop('ttl', None)
+
         # Store creation arguments for pickling
         self._args = args
         self._kwargs = kwargs
 
         # Create the client
-        self._client = redis.StrictRedis(*args, **kwargs)
+        self._connect()
+
+    def _connect(self):
+        """Creates the redis client and the per-thread record of observed
+        generations.
+        """
+        # Track the generations observed by each thread's most recent lookup,
+        # so that values computed after a miss are tagged with the generations
+        # that were current when the miss occurred, rather than any later
+        # generations
+        self._observed = threading.local()
+
+        # Create the client
+        if self._shared_pool:
+            self._client = redis.StrictRedis(
+                connection_pool = shared_connection_pool(
+                    *self._args,
+                    **self._kwargs
+                )
+            )
+        else:
+            self._client = redis.StrictRedis(*self._args, **self._kwargs)
 
     def __getstate__(self):
         """Returns a reconstructable state for pickling.
         """
-        return (self._args, self._kwargs, self._prefix)
+        return {
+            'args': self._args,
+            'kwargs': self._kwargs,
+            'prefix': self._prefix,
+            'serializer': self._serializer,
+            'shared_pool': self._shared_pool,
+            'ttl': self._ttl,
+        }
 
     def __setstate__(self, state):
         """Sets the object state from pickling information.
@@ -63,19 +165,180 @@ class RedisPersistentCache(PersistentCache):
         Args:
             state: The object state
         """
+        # Handle states pickled by older versions
+        if isinstance(state, tuple):
+            state = dict(zip(('args', 'kwargs', 'prefix'), state))
+
         # Recreate the client
-        self._args, self._kwargs, self._prefix = state
-        self._client = redis.StrictRedis(*self._args, **self._kwargs)
+        self._args = state['args']
+        self._kwargs = state['kwargs']
+        self._prefix = state['prefix']
+        self._serializer = state.get('serializer', default_serializer)
+        self._shared_pool = state.get('shared_pool', False)
+        self._ttl = state.get('ttl')
+        self._connect()
+
+    def _key(self, key):
+        """Computes the redis key for a cache key.
+
+        Args:
+            key: The cache key
+
+        Returns:
+            The prefixed redis key.
+        """
+        return self._prefix + key
+
+    def _generation_key(self, name = None):
+        """Computes the redis key of a generation counter.
+
+        Args:
+            name: The cached callable name, or None for the prefix generation
+
+        Returns:
+            The redis key.
+        """
+        if name is None:
+            return self._prefix + _GENERATION_KEY
+        return '{0}{1}:{2}'.format(self._prefix, _GENERATION_KEY, name)
+
+    def _fetch(self, keys, extra = ()):
+        """Fetches the current generations for a list of keys, along with
+        additional redis keys, in a single round trip.
 
-    def set(self, key, value):
+        Args:
+            keys: The list of cache keys
+            extra: A list of additional (prefixed) redis keys to fetch
+
+        Returns:
+            A tuple of the form (generations, values), where generations is a
+            list of (prefix generation, name generation) tuples corresponding
+            to the keys and values is the list of values for the additional
+            redis keys.
+        """
+        # Fetch the prefix generation and the generation for each name
+        names = [key_name(k) for k in keys]
+        distinct = list(set(n for n in names if n is not None))
+        generation_keys = [self._generation_key()]
+        generation_keys.extend(self._generation_key(n) for n in distinct)
+        values = self._client.mget(generation_keys + list(extra))
+        counters = [int(v or 0) for v in values[:len(generation_keys)]]
+
+        # Compute the generations for each key
+        prefix_generation = counters[0]
+        name_generations = dict(zip(distinct, counters[1:]))
+        generations = [(prefix_generation, name_generations.get(n, 0))
+                       for n in names]
+        return generations, values[len(generation_keys):]
+
+    def _generations(self, keys):
+        """Determines the generations with which to tag values for a list of
+        keys, preferring those observed by the calling thread's most recent
+        lookup.
+
+        Args:
+            keys: The list of cache keys
+
+        Returns:
+            A list of (prefix generation, name generation) tuples.
+        """
+        observed = getattr(self._observed, 'generations', {})
+        if all(k in observed for k in keys):
+            return [observed.pop(k) for k in keys]
+        return self._fetch(keys)[0]
+
+    def _expiry(self, ttl):
+        """Computes the expiry of a stored value.
+
+        Args:
+            ttl: The time-to-live in seconds, or None to use the default
+
+        Returns:
+            The expiry in milliseconds, or None for no expiry.
+        """
+        if ttl is None:
+            ttl = self._ttl
+        if ttl is None:
+            return None
+        return max(int(ttl * 1000), 1)
+
+    def _encode(self, value, generations):
+        """Serializes a value, tagging it with its generations.
+
+        Args:
+            value: The value
+            generations: The tuple of (prefix generation, name generation)
+
+        Returns:
+            The serialized value, as a byte string.
+        """
+        return _TAG_MAGIC + _TAG.pack(*generations) + \
+            self._serializer.dumps(value)
+
+    def _decode(self, cache_value, generations):
+        """Deserializes a value retrieved from redis, recording statistics.
+
+        Args:
+            cache_value: The raw value, or None if the key was not found
+            generations: The current (prefix generation, name generation)
+                tuple for the key
+
+        Returns:
+            The deserialized value, or None if the key was not found or if
+            its generation has been invalidated.
+        """
+        # Check the generation tag.  Untagged values (written by older
+        # versions) are only valid until the first invalidation.
+        if cache_value:
+            offset = len(_TAG_MAGIC)
+            if cache_value[:offset] == _TAG_MAGIC:
+                if _TAG.unpack_from(cache_value, offset) != generations:
+                    cache_value = None
+                else:
+                    cache_value = memoryview(cache_value)[offset + _TAG.size:]
+            elif generations != (0, 0):
+                cache_value = None
+
+        # Handle misses
+        if not cache_value:
+            self.statistics.count('misses')
+            return None
+
+        # Deserialize the value
+        result = self._serializer.loads(cache_value)
+        self.statistics.count('hits')
+        self.statistics.count('bytes_read', len(cache_value))
+        return result
+
+    def invalidate(self, name = None):
+        """Invalidates all entries for a cached callable name, or all entries
+        with this instance's prefix, in constant time.
+
+        Args:
+            name: The cached callable name, or None (the default) to
+                invalidate all entries with the prefix
+        """
+        self._client.incr(self._generation_key(name))
+
+    def set(self, key, value, ttl = None):
         """Sets the cache value for a given key, overwriting any previous
         value set for that key.
 
         Args:
             key: The key to update
             value: The value to set
+            ttl: The time-to-live of the entry in seconds, or None (the
+                default) to use the configured default
         """
-        self._client.set(key, dumps(value))
+        with self.statistics.timing('set'):
+            generations = self._generations([key])[0]
+            cache_value = self._encode(value, generations)
+            self._client.set(
+                self._key(key),
+                cache_value,
+                px = self._expiry(ttl)
+            )
+        self.statistics.count('bytes_written', len(cache_value))
 
     def get(self, key):
         """Gets the cache value for a given key, if any.
@@ -86,10 +349,59 @@ class RedisPersistentCache(PersistentCache):
         Returns:
             The associated value, or None if the key is not found.
         """
-        # Get the value, if any
-        cache_value = self._client.get(key)
-        if not cache_value:
-            return None
+        return self.get_many([key])[0]
+
+    def set_many(self, items, ttl = None):
+        """Sets the cache values for many keys in a single round trip,
+        overwriting any previous values set for those keys.
+
+        Args:
+            items: A dictionary or an iterable of (key, value) pairs
+            ttl: The time-to-live of the entries in seconds, or None (the
+                default) to use the configured default
+        """
+        items = list(iteritems(items) if isinstance(items, dict) else items)
+        if not items:
+            return
+        with self.statistics.timing('set'):
+            generations = self._generations([k for k, _ in items])
+            expiry = self._expiry(ttl)
+            pipeline = self._client.pipeline(transaction = False)
+            written = 0
+            for (key, value), generation in zip(items, generations):
+                cache_value = self._encode(value, generation)
+                pipeline.set(self._key(key), cache_value, px = expiry)
+                written += len(cache_value)
+            pipeline.execute()
+        self.statistics.count('bytes_written', written)
+
+    def get_many(self, keys):
+        """Gets the cache values for many keys in a single round trip.
+
+        Args:
+            keys: An iterable of keys to locate
+
+        Returns:
+            A list of the associated values, in the same order as the keys,
+            with None for keys which are not found.
+        """
+        keys = list(keys)
+        if not keys:
+            return []
+        with self.statistics.timing('get'):
+            # Fetch the generations and values together
+            generations, values = self._fetch(
+                keys,
+                [self._key(k) for k in keys]
+            )
 
-        # Deserialize it
-        return loads(cache_value)
+            # Decode the values, remembering the generations of misses
+            results = []
+            observed = {}
+            for key, generation, value in zip(keys, generations, values):
+                result = self._decode(value, generation)
+                if result is None:
+                    observed[key] = generation
+                results.append(result)
+            self._observed.generations = observed
+            return results
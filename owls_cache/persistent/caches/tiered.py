@@ -0,0 +1,341 @@
+"""Provides a tiered persistent caching backend, which layers a bounded
+in-process memory tier over one or more other backends.
+"""
+
+
+# System imports
+import threading
+
+# Six imports
+from six import iteritems
+
+# owls-cache imports
+from owls_cache.transient.sizing import default_sizer
+from owls_cache.transient.policies import create_policy
+from owls_cache.persistent.keys import key_name
+from owls_cache.persistent.caches import PersistentCache
+
+
+class TieredPersistentCache(PersistentCache):
+    """Implements a persistent cache as a chain of tiers, the first of which
+    is a bounded in-process memory tier (L1) and the rest of which are other
+    persistent caching backends (e.g. a file system backend in front of a
+    redis backend).
+
+    Lookups consult the tiers in order, and values found in a lower tier are
+    promoted into all the tiers above it.  Stores either go to all tiers
+    immediately (write-through) or only to the memory tier, with the lower
+    tiers updated when entries are evicted from memory or when `flush` is
+    called (write-back).
+
+    Values held in the memory tier are returned as-is, without copying, so
+    they should not be mutated by callers.
+    """
+
+    def __init__(self, *backends, **kwargs):
+        """Initializes a new instance of the TieredPersistentCache.
+
+        Args:
+            backends: The lower tiers, in lookup order
+            max_entries: The maximum number of entries in the memory tier, or
+                None for no limit.  Defaults to 1024.
+            max_bytes: The maximum total size of values in the memory tier, in
+                bytes (as estimated by the sizer), or None (the default) for
+                no limit
+            policy: The eviction policy for the memory tier, as a name or
+                factory accepted by
+                `owls_cache.transient.policies.create_policy`.  Defaults to
+                'lru'.
+            sizer: The callable used to estimate the size of values in bytes
+                (see `owls_cache.transient.sizing`), only used if `max_bytes`
+                is specified
+            write_back: Whether or not to defer stores to the lower tiers
+                until entries are evicted from memory or flushed.  Defaults to
+                False (write-through).  Deferred stores are lost if the
+                process exits without calling `flush`.
+        """
+        # Check for keyword arguments
+        self._max_entries = kwargs.pop('max_entries', 1024)
+        self._max_bytes = kwargs.pop('max_bytes', None)
+        self._policy_name = kwargs.pop('policy', 'lru')
+        self._sizer = kwargs.pop('sizer', default_sizer)
+        self._write_back = kwargs.pop('write_back', False)
+        if kwargs:
+            raise TypeError('unexpected keyword arguments: {0}'.format(
+                ', '.join(sorted(kwargs))
+            ))
+
+        # Store the lower tiers
+        self._backends = backends
+
+        # Create the memory tier
+        self._create_memory()
+
+    def _create_memory(self):
+        """Creates the (empty) memory tier.
+        """
+        self._lock = threading.Lock()
+        self._entries = {}
+        self._dirty = {}
+        self._policy = create_policy(self._policy_name)
+        self._policy.capacity = self._max_entries
+        self._total_bytes = 0
+
+    def __getstate__(self):
+        """Returns a reconstructable state for pickling, excluding the memory
+        tier (including any deferred stores).
+        """
+        state = super(TieredPersistentCache, self).__getstate__()
+        for name in ('_lock', '_entries', '_dirty', '_policy', '_total_bytes'):
+            del state[name]
+        return state
+
+    def __setstate__(self, state):
+        """Sets the object state from pickling information.
+
+        Args:
+            state: The object state
+        """
+        self.__dict__.update(state)
+        self._create_memory()
+
+    @property
+    def backends(self):
+        """The tuple of lower tiers.
+        """
+        return self._backends
+
+    def _evict(self, incoming):
+        """Evicts the entry chosen by the policy.  The lock must be held.
+
+        Args:
+            incoming: The key for which room is being made
+
+        Returns:
+            A tuple of the form (key, value, options) if the evicted entry had
+            a deferred store, None otherwise.
+        """
+        key = self._policy.evict(incoming)
+        value, nbytes = self._entries.pop(key)
+        self._total_bytes -= nbytes
+        self.statistics.count('evictions')
+        options = self._dirty.pop(key, None)
+        return None if options is None else (key, value, options)
+
+    def _remember(self, key, value, options = None):
+        """Stores a value in the memory tier, evicting entries as necessary.
+
+        Args:
+            key: The key
+            value: The value
+            options: The store options to record for a deferred store to the
+                lower tiers, or None if the value need not be written
+
+        Returns:
+            A list of (key, value, options) tuples for evicted entries with
+            deferred stores, which must be written to the lower tiers.
+        """
+        # Size the value if necessary
+        nbytes = 0 if self._max_bytes is None else self._sizer(value)
+
+        # Values which could never fit are passed straight through
+        evicted = []
+        if self._max_entries == 0 or \
+                (self._max_bytes is not None and nbytes > self._max_bytes):
+            if options is not None:
+                evicted.append((key, value, options))
+            return evicted
+
+        with self._lock:
+            # Replace any existing entry
+            entries = self._entries
+            previous = entries.pop(key, None)
+            if previous is not None:
+                self._total_bytes -= previous[1]
+                self._policy.remove(key)
+
+            # Make room
+            while entries and (
+                (self._max_entries is not None and
+                 len(entries) >= self._max_entries) or
+                (self._max_bytes is not None and
+                 self._total_bytes + nbytes > self._max_bytes)
+            ):
+                victim = self._evict(key)
+                if victim is not None:
+                    evicted.append(victim)
+
+            # Store the entry
+            entries[key] = (value, nbytes)
+            self._policy.insert(key)
+            self._total_bytes += nbytes
+            if options is not None:
+                self._dirty[key] = options
+            else:
+                self._dirty.pop(key, None)
+
+        return evicted
+
+    def _write(self, items):
+        """Writes entries to the lower tiers.
+
+        Args:
+            items: A list of (key, value, options) tuples
+        """
+        # Group the entries by options so they can be stored in batches
+        groups = {}
+        for key, value, options in items:
+            group = tuple(sorted(iteritems(options)))
+            groups.setdefault(group, []).append((key, value))
+        for group, pairs in iteritems(groups):
+            for backend in self._backends:
+                backend.set_many(pairs, **dict(group))
+
+    def flush(self):
+        """Writes all deferred stores to the lower tiers, then flushes the
+        lower tiers themselves.
+        """
+        with self._lock:
+            items = [(k, self._entries[k][0], o)
+                     for k, o in iteritems(self._dirty)]
+            self._dirty.clear()
+        if items:
+            self._write(items)
+        for backend in self._backends:
+            backend.flush()
+
+    def invalidate(self, name = None):
+        """Invalidates all entries for a cached callable name, or all entries
+        in the cache, in every tier.
+
+        All lower tiers must support invalidation.
+
+        Args:
+            name: The cached callable name, or None (the default) to
+                invalidate all entries
+        """
+        # Drop matching entries (including deferred stores) from memory
+        with self._lock:
+            for key in list(self._entries):
+                if name is None or key_name(key) == name:
+                    _, nbytes = self._entries.pop(key)
+                    self._total_bytes -= nbytes
+                    self._policy.remove(key)
+                    self._dirty.pop(key, None)
+
+        # Invalidate the lower tiers
+        for backend in self._backends:
+            backend.invalidate(name)
+
+    def _lookup(self, key):
+        """Looks up a key in the memory tier, recording the access.
+
+        Args:
+            key: The key
+
+        Returns:
+            The value, or None if the key is not held in memory.
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            self._policy.access(key)
+            return entry[0]
+
+    def set(self, key, value, **options):
+        """Sets the cache value for a given key, overwriting any previous
+        value set for that key.
+
+        Args:
+            key: The key to update
+            value: The value to set
+            options: Additional backend-specific options (e.g. `ttl`) passed
+                to the lower tiers
+        """
+        self.set_many([(key, value)], **options)
+
+    def get(self, key):
+        """Gets the cache value for a given key, if any.
+
+        Args:
+            key: The key to locate
+
+        Returns:
+            The associated value, or None if the key is not found.
+        """
+        return self.get_many([key])[0]
+
+    def set_many(self, items, **options):
+        """Sets the cache values for many keys, overwriting any previous values
+        set for those keys.
+
+        Args:
+            items: A dictionary or an iterable of (key, value) pairs
+            options: Additional backend-specific options (e.g. `ttl`) passed
+                to the lower tiers
+        """
+        items = list(iteritems(items) if isinstance(items, dict) else items)
+        with self.statistics.timing('set'):
+            # Store the values in memory, collecting evicted deferred stores
+            pending = []
+            for key, value in items:
+                pending.extend(self._remember(
+                    key,
+                    value,
+                    options if self._write_back else None
+                ))
+
+            # Write through if necessary
+            if not self._write_back:
+                pending.extend((k, v, options) for k, v in items)
+            if pending:
+                self._write(pending)
+
+    def get_many(self, keys):
+        """Gets the cache values for many keys, consulting each tier in turn
+        with a single batched lookup for the keys not yet found.
+
+        Args:
+            keys: An iterable of keys to locate
+
+        Returns:
+            A list of the associated values, in the same order as the keys,
+            with None for keys which are not found.
+        """
+        keys = list(keys)
+        with self.statistics.timing('get'):
+            # Check the memory tier
+            results = [self._lookup(k) for k in keys]
+            missing = [i for i, r in enumerate(results) if r is None]
+            self.statistics.count('hits', len(keys) - len(missing))
+
+            # Check the lower tiers in turn, promoting values found in each
+            # into all of the tiers above it
+            pending = []
+            for level, backend in enumerate(self._backends):
+                if not missing:
+                    break
+                found = backend.get_many([keys[i] for i in missing])
+                promoted = []
+                remaining = []
+                for i, value in zip(missing, found):
+                    if value is None:
+                        remaining.append(i)
+                        continue
+                    results[i] = value
+                    promoted.append((keys[i], value))
+                    pending.extend(self._remember(keys[i], value))
+                if promoted:
+                    self.statistics.count('hits', len(promoted))
+                    for upper in self._backends[:level]:
+                        upper.set_many(promoted)
+                missing = remaining
+
+            # Write any deferred stores evicted by promotion
+            if pending:
+                self._write(pending)
+
+        # Record the misses
+        self.statistics.count('misses', len(missing))
+        return results
@@ -0,0 +1,276 @@
+"""Provides a persistent caching backend wrapper which performs stores
+asynchronously on background threads.
+"""
+
+
+# System imports
+from collections import OrderedDict
+import threading
+import logging
+
+# Six imports
+from six import iteritems
+
+# owls-cache imports
+from owls_cache.persistent.keys import key_name
+from owls_cache.persistent.caches import PersistentCache
+
+
+# Write-behind cache logger
+_write_behind_log = logging.getLogger(__name__)
+
+
+class WriteBehindPersistentCache(PersistentCache):
+    """Wraps a persistent caching backend, queueing stores to a pool of
+    background worker threads so that callers never block on serialization
+    or backend I/O.
+
+    Queued values are visible to lookups through this wrapper immediately.
+    Multiple stores to the same key before it is written are coalesced into a
+    single store of the latest value, and a key is never written by more than
+    one worker at a time, so stores to a key are applied in order.  When the
+    queue is full, stores block until the workers catch up.
+
+    Queued stores are lost if the process exits without calling `flush`
+    (which `owls_cache.persistent.caching_into` does automatically on exit).
+    Errors raised by the wrapped backend are logged and the affected values
+    are dropped.
+    """
+
+    def __init__(self, backend, workers = 1, max_pending = 1024,
+                 batch_size = 64):
+        """Initializes a new instance of the WriteBehindPersistentCache.
+
+        Args:
+            backend: The persistent caching backend to wrap
+            workers: The number of background worker threads.  Defaults to 1.
+            max_pending: The maximum number of queued stores, beyond which
+                stores block.  Defaults to 1024.
+            batch_size: The maximum number of values written by a worker with
+                a single call to the backend's `set_many` method.  Defaults to
+                64.
+        """
+        # Validate arguments
+        if workers < 1 or max_pending < 1 or batch_size < 1:
+            raise ValueError('invalid write-behind configuration')
+
+        # Store the configuration
+        self._backend = backend
+        self._worker_count = workers
+        self._max_pending = max_pending
+        self._batch_size = batch_size
+
+        # Create the queue
+        self._create_queue()
+
+    def _create_queue(self):
+        """Creates the (empty) queue.  Workers are started on first use.
+        """
+        self._condition = threading.Condition()
+        self._pending = OrderedDict()
+        self._writing = {}
+        self._workers = []
+
+    def __getstate__(self):
+        """Returns a reconstructable state for pickling, excluding queued
+        stores.
+        """
+        state = super(WriteBehindPersistentCache, self).__getstate__()
+        for name in ('_condition', '_pending', '_writing', '_workers'):
+            del state[name]
+        return state
+
+    def __setstate__(self, state):
+        """Sets the object state from pickling information.
+
+        Args:
+            state: The object state
+        """
+        self.__dict__.update(state)
+        self._create_queue()
+
+    @property
+    def backend(self):
+        """The wrapped backend.
+        """
+        return self._backend
+
+    def _start_workers(self):
+        """Starts the worker threads if they are not running.  The condition
+        lock must be held.
+        """
+        while len(self._workers) < self._worker_count:
+            worker = threading.Thread(target = self._work)
+            worker.daemon = True
+            worker.start()
+            self._workers.append(worker)
+
+    def _take(self):
+        """Removes a batch of queued stores whose keys are not being written
+        and marks them as being written.  The condition lock must be held.
+
+        Returns:
+            A list of (key, value, options) tuples, which may be empty.
+        """
+        batch = []
+        for key in list(self._pending):
+            if key in self._writing:
+                continue
+            value, options = self._pending.pop(key)
+            self._writing[key] = value
+            batch.append((key, value, options))
+            if len(batch) == self._batch_size:
+                break
+        return batch
+
+    def _work(self):
+        """Runs a worker thread.
+        """
+        while True:
+            # Wait for work
+            with self._condition:
+                batch = self._take()
+                while not batch:
+                    self._condition.wait()
+                    batch = self._take()
+                self._condition.notify_all()
+
+            # Write the batch, grouping values by their store options
+            try:
+                groups = OrderedDict()
+                for key, value, options in batch:
+                    group = tuple(sorted(iteritems(options)))
+                    groups.setdefault(group, []).append((key, value))
+                for group, items in iteritems(groups):
+                    self._backend.set_many(items, **dict(group))
+            except Exception:
+                _write_behind_log.warning(
+                    'failed to write %d cache entries',
+                    len(batch),
+                    exc_info = True
+                )
+
+            # Mark the batch as written
+            with self._condition:
+                for key, _, _ in batch:
+                    del self._writing[key]
+                self._condition.notify_all()
+
+    def flush(self):
+        """Waits until all queued stores have been written to the wrapped
+        backend, then flushes the wrapped backend itself.
+        """
+        with self._condition:
+            while self._pending or self._writing:
+                self._condition.wait()
+        self._backend.flush()
+
+    def invalidate(self, name = None):
+        """Invalidates all entries for a cached callable name, or all entries
+        in the cache, discarding any matching queued stores.
+
+        Args:
+            name: The cached callable name, or None (the default) to
+                invalidate all entries
+        """
+        # Discard matching queued stores and wait for those being written
+        with self._condition:
+            for key in list(self._pending):
+                if name is None or key_name(key) == name:
+                    del self._pending[key]
+            self._condition.notify_all()
+        self.flush()
+
+        # Invalidate the wrapped backend
+        self._backend.invalidate(name)
+
+    def _queued(self, key):
+        """Returns the queued or in-progress value for a key, if any.  The
+        condition lock must be held.
+
+        Args:
+            key: The key
+
+        Returns:
+            The value, or None if no store is queued or in progress.
+        """
+        entry = self._pending.get(key)
+        if entry is not None:
+            return entry[0]
+        return self._writing.get(key)
+
+    def set(self, key, value, **options):
+        """Queues a store of the cache value for a given key.
+
+        Args:
+            key: The key to update
+            value: The value to set
+            options: Additional backend-specific options (e.g. `ttl`) passed
+                to the wrapped backend
+        """
+        self.set_many([(key, value)], **options)
+
+    def get(self, key):
+        """Gets the cache value for a given key, if any, including queued
+        values.
+
+        Args:
+            key: The key to locate
+
+        Returns:
+            The associated value, or None if the key is not found.
+        """
+        return self.get_many([key])[0]
+
+    def set_many(self, items, **options):
+        """Queues stores of the cache values for many keys.
+
+        Args:
+            items: A dictionary or an iterable of (key, value) pairs
+            options: Additional backend-specific options (e.g. `ttl`) passed
+                to the wrapped backend
+        """
+        if isinstance(items, dict):
+            items = iteritems(items)
+        with self.statistics.timing('set'):
+            with self._condition:
+                self._start_workers()
+                for key, value in items:
+                    # Apply backpressure to new keys
+                    while key not in self._pending and \
+                            len(self._pending) >= self._max_pending:
+                        self._condition.wait()
+
+                    # Queue the store, replacing any queued value
+                    self._pending[key] = (value, options)
+                    self._condition.notify_all()
+
+    def get_many(self, keys):
+        """Gets the cache values for many keys, including queued values, with
+        a single batched lookup in the wrapped backend for the remainder.
+
+        Args:
+            keys: An iterable of keys to locate
+
+        Returns:
+            A list of the associated values, in the same order as the keys,
+            with None for keys which are not found.
+        """
+        keys = list(keys)
+        with self.statistics.timing('get'):
+            # Check the queue
+            with self._condition:
+                results = [self._queued(k) for k in keys]
+
+            # Look up the remainder in the backend
+            missing = [i for i, r in enumerate(results) if r is None]
+            if missing:
+                found = self._backend.get_many([keys[i] for i in missing])
+                for i, value in zip(missing, found):
+                    results[i] = value
+
+        # Record statistics
+        misses = sum(1 for r in results if r is None)
+        self.statistics.count('hits', len(results) - misses)
+        self.statistics.count('misses', misses)
+        return results
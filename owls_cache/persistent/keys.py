@@ -0,0 +1,160 @@
+"""Provides deterministic, process-independent cache keys for persistent
+caching.
+
+Keys are computed by serializing the cache name and the identifier state into
+a canonical, versioned byte representation and digesting it with BLAKE2b.
+Unlike the built-in `hash` function, which is randomized per-interpreter for
+strings, the resulting keys are identical across processes, hosts, and runs.
+"""
+
+
+# System imports
+from hashlib import blake2b
+
+# Six imports
+from six import binary_type, integer_types, iteritems, text_type
+
+
+# The current version of the key serialization format.  This value is mixed
+# into every key, so it must be bumped whenever the encoding changes in a way
+# that could alter keys.
+KEY_VERSION = 1
+
+
+# The digest size (in bytes) of computed keys
+_DIGEST_SIZE = 20
+
+
+def _encode_sized(tag, data):
+    """Encodes a tagged, length-prefixed byte string.
+
+    Args:
+        tag: The single-byte type tag
+        data: The byte string payload
+
+    Returns:
+        The encoded byte string.
+    """
+    return tag + str(len(data)).encode('ascii') + b':' + data
+
+
+def _encode_sequence(tag, items):
+    """Encodes a tagged, count-prefixed sequence of already-encoded items.
+
+    Args:
+        tag: The single-byte type tag
+        items: A list of encoded byte strings
+
+    Returns:
+        The encoded byte string.
+    """
+    return tag + str(len(items)).encode('ascii') + b':' + b''.join(items)
+
+
+def canonical_encode(value):
+    """Encodes a value into a canonical byte representation.
+
+    The encoding is independent of interpreter hash seeds, dictionary and set
+    ordering, and object identity.  Supported types are None, booleans,
+    integers, floats, text and byte strings, tuples, lists, dictionaries, sets,
+    frozensets, and any object providing a `state()` method whose return value
+    is itself encodable.
+
+    Args:
+        value: The value to encode
+
+    Returns:
+        The canonical byte string encoding of the value.
+
+    Raises:
+        TypeError: If the value (or a value nested within it) has no canonical
+            encoding.
+    """
+    # Handle singletons and booleans (which must precede integers since bool is
+    # a subclass of int)
+    if value is None:
+        return b'N'
+    elif value is True:
+        return b'T'
+    elif value is False:
+        return b'F'
+
+    # Handle scalar types
+    if isinstance(value, integer_types):
+        return _encode_sized(b'I', str(value).encode('ascii'))
+    elif isinstance(value, float):
+        return _encode_sized(b'D', value.hex().encode('ascii'))
+    elif isinstance(value, text_type):
+        return _encode_sized(b'S', value.encode('utf-8'))
+    elif isinstance(value, binary_type):
+        return _encode_sized(b'B', value)
+
+    # Handle ordered containers
+    if isinstance(value, tuple):
+        return _encode_sequence(b'(', [canonical_encode(v) for v in value])
+    elif isinstance(value, list):
+        return _encode_sequence(b'[', [canonical_encode(v) for v in value])
+
+    # Handle unordered containers by sorting their encoded representations
+    if isinstance(value, dict):
+        return _encode_sequence(b'{', sorted(
+            canonical_encode(k) + canonical_encode(v)
+            for k, v
+            in iteritems(value)
+        ))
+    elif isinstance(value, (set, frozenset)):
+        return _encode_sequence(b'<', sorted(
+            canonical_encode(v) for v in value
+        ))
+
+    # Handle objects which provide their own state
+    state = getattr(value, 'state', None)
+    if callable(state):
+        return _encode_sequence(b'@', [canonical_encode(state())])
+
+    # Otherwise we have no way to encode this value deterministically
+    raise TypeError('no canonical encoding for type {0}'.format(
+        type(value).__name__
+    ))
+
+
+def compute_key(name, state):
+    """Computes a deterministic cache key for a named callable and argument
+    state.
+
+    Keys have the form `<name>:<digest>`, where the digest is the hexadecimal
+    BLAKE2b digest of the canonical, versioned encoding of the name and state.
+
+    Args:
+        name: The name of the cached callable
+        state: The (canonically encodable) state of the call arguments
+
+    Returns:
+        The cache key, as a string.
+
+    Raises:
+        TypeError: If the state has no canonical encoding.
+    """
+    # Digest the versioned encoding
+    digest = blake2b(digest_size = _DIGEST_SIZE)
+    digest.update(canonical_encode((KEY_VERSION, name, state)))
+
+    # Create the key
+    return '{0}:{1}'.format(name, digest.hexdigest())
+
+
+def key_name(key):
+    """Extracts the name of the cached callable from a key generated by
+    `compute_key`.
+
+    Args:
+        key: The cache key
+
+    Returns:
+        The callable name, or None if the key was not generated by
+        `compute_key`.
+    """
+    name, separator, digest = key.rpartition(':')
+    if not separator or len(digest) != 2 * _DIGEST_SIZE:
+        return None
+    return name
@@ -0,0 +1,139 @@
+"""Provides a raw, memory-mappable storage format for array-valued cache
+entries.
+
+Entries in this format consist of a magic string, a small JSON header
+describing the array, padding to a 64-byte boundary, and the raw array data.
+Reading an entry memory-maps the file and returns a read-only view onto it, so
+that the cost of a cache hit is proportional to the pages actually touched,
+and processes reading the same entry share physical memory through the
+operating system's page cache.
+
+Supported values are NumPy arrays with simple (non-object, non-structured)
+dtypes, and contiguous memoryviews.  NumPy is not a dependency of this module;
+it is only imported when reading an entry written from a NumPy array.
+"""
+
+
+# System imports
+from mmap import mmap, ACCESS_READ
+import json
+import struct
+
+
+# The magic string identifying memory-mappable entries
+MAGIC = b'OWLSMAP\x01'
+
+
+# The alignment of the data section, in bytes
+_ALIGNMENT = 64
+
+
+# The format of the header length field
+_LENGTH = struct.Struct('<I')
+
+
+def _is_numpy_array(value):
+    """Checks whether a value is a NumPy array, without importing NumPy.
+
+    Args:
+        value: The value to check
+
+    Returns:
+        True if the value is a NumPy array, False otherwise.
+    """
+    value_type = type(value)
+    return value_type.__module__ == 'numpy' and \
+        value_type.__name__ == 'ndarray'
+
+
+def is_mappable(value):
+    """Checks whether a value can be stored in the memory-mappable format.
+
+    Args:
+        value: The value to check
+
+    Returns:
+        True if the value can be stored, False otherwise.
+    """
+    if _is_numpy_array(value):
+        dtype = value.dtype
+        return not dtype.hasobject and dtype.fields is None and \
+            dtype.subdtype is None
+    if isinstance(value, memoryview):
+        # NOTE: Views can only be recreated for native, single-item formats
+        return value.c_contiguous and len(value.format.lstrip('@')) == 1
+    return False
+
+
+def write(value, f):
+    """Writes a mappable value to a file.
+
+    Args:
+        value: The value, which must satisfy `is_mappable`
+        f: The binary file object to write to
+
+    Returns:
+        The number of bytes written.
+    """
+    # Create the header and extract the raw data
+    if _is_numpy_array(value):
+        header = {
+            'kind': 'ndarray',
+            'dtype': value.dtype.str,
+            'shape': list(value.shape),
+        }
+        if not value.flags.c_contiguous:
+            value = value.copy(order = 'C')
+        data = memoryview(value.reshape(-1)).cast('B')
+    else:
+        header = {
+            'kind': 'memoryview',
+            'format': value.format,
+            'shape': list(value.shape),
+        }
+        data = value.cast('B') if value.ndim else value.tobytes()
+
+    # Encode and pad the header
+    header = json.dumps(header, sort_keys = True).encode('utf-8')
+    prefix_length = len(MAGIC) + _LENGTH.size + len(header)
+    padding = -prefix_length % _ALIGNMENT
+
+    # Write everything
+    f.write(MAGIC)
+    f.write(_LENGTH.pack(len(header) + padding))
+    f.write(header + b' ' * padding)
+    f.write(data)
+    return prefix_length + padding + len(data)
+
+
+def read(f):
+    """Reads a mappable value from a file positioned just after the magic
+    string.
+
+    Args:
+        f: The binary file object to read from
+
+    Returns:
+        A read-only view of the value backed by a memory map of the file.
+    """
+    # Read the header
+    header_length = _LENGTH.unpack(f.read(_LENGTH.size))[0]
+    header = json.loads(f.read(header_length).decode('utf-8'))
+    offset = len(MAGIC) + _LENGTH.size + header_length
+
+    # Map the file.  The mapping remains valid after the file is closed or
+    # replaced.
+    mapping = mmap(f.fileno(), 0, access = ACCESS_READ)
+    data = memoryview(mapping)[offset:]
+
+    # Create the view
+    shape = tuple(header['shape'])
+    if header['kind'] == 'ndarray':
+        import numpy
+        dtype = numpy.dtype(header['dtype'])
+        if not len(data):
+            result = numpy.empty(shape, dtype = dtype)
+            result.flags.writeable = False
+            return result
+        return numpy.frombuffer(data, dtype = dtype).reshape(shape)
+    return data.cast(header['format'], shape)
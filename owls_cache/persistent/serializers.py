@@ -0,0 +1,367 @@
+"""Provides the serialization layer shared by persistent caching backends.
+
+Serialized values carry a small self-describing header recording the
+compression codec and whether or not pickle out-of-band buffers are used, so
+that values written with any serializer configuration can be read by any
+other.  Values without a header (as written by older versions of owls-cache)
+are read as plain pickles.
+
+The header layout is:
+
+    MAGIC (8 bytes) | codec (1 byte) | flags (1 byte) | body
+
+where the body is optionally compressed.  Once decompressed, bodies without
+out-of-band buffers are a plain pickle, while bodies with out-of-band buffers
+have the layout:
+
+    buffer count (4 bytes) | pickle length (8 bytes) |
+        buffer lengths (8 bytes each) | pickle | buffers
+"""
+
+
+# System imports
+import struct
+import zlib
+import bz2
+try:
+    import lzma
+except ImportError:
+    lzma = None
+
+# Six imports
+from six.moves import cPickle as pickle
+
+
+# The magic string identifying serialized values with a header
+MAGIC = b'OWLSSER\x01'
+
+
+# The flag indicating out-of-band buffers
+_FLAG_OUT_OF_BAND = 0x01
+
+
+# The formats of the out-of-band body fields
+_COUNT = struct.Struct('<I')
+_LENGTH = struct.Struct('<Q')
+
+
+# Compression codecs, as tuples of the form (identifier, compress function,
+# decompress function)
+_CODECS = {
+    None: (0, None, None),
+    'zlib': (1, zlib.compress, zlib.decompress),
+    'bz2': (3, bz2.compress, bz2.decompress),
+}
+if lzma is not None:
+    def _lzma_compress(data, level):
+        """Compresses data with lzma.
+
+        Args:
+            data: The data to compress
+            level: The compression preset
+
+        Returns:
+            The compressed data.
+        """
+        return lzma.compress(data, preset = level)
+    _CODECS['lzma'] = (2, _lzma_compress, lzma.decompress)
+
+
+# A mapping from codec identifiers to decompression functions
+_DECOMPRESSORS = dict((i, d) for i, _, d in _CODECS.values())
+
+
+# The default compression levels for each codec
+_DEFAULT_LEVELS = {
+    'zlib': 6,
+    'bz2': 9,
+    'lzma': 6,
+}
+
+
+class Serializer(object):
+    """The base serializer.  This serializer should be subclassed by concrete
+    implementations.
+    """
+
+    def dumps(self, value):
+        """Serializes a value.
+
+        Args:
+            value: The value to serialize
+
+        Returns:
+            The serialized value, as a byte string.
+        """
+        raise NotImplementedError('abstract method')
+
+    def loads(self, data):
+        """Deserializes a value.
+
+        Args:
+            data: The serialized value, as a bytes-like object
+
+        Returns:
+            The value.
+        """
+        raise NotImplementedError('abstract method')
+
+    def dump(self, value, f):
+        """Serializes a value to a file.
+
+        Args:
+            value: The value to serialize
+            f: The binary file object to write to
+        """
+        f.write(self.dumps(value))
+
+    def load(self, f):
+        """Deserializes a value from a file.
+
+        Args:
+            f: The binary file object to read from
+
+        Returns:
+            The value.
+        """
+        return self.loads(f.read())
+
+
+class PickleSerializer(Serializer):
+    """Serializes values with pickle, optionally using out-of-band buffers and
+    compression.
+    """
+
+    def __init__(self, protocol = pickle.HIGHEST_PROTOCOL,
+                 out_of_band = False, compression = None, level = None,
+                 threshold = 4096):
+        """Initializes a new instance of the PickleSerializer class.
+
+        Args:
+            protocol: The pickle protocol to use.  Defaults to the highest
+                protocol available.
+            out_of_band: Whether or not to serialize buffers (e.g. NumPy array
+                data) out-of-band, avoiding copies of large buffers within the
+                pickle stream.  Deserialized objects then reference the
+                serialized data directly, so buffer-backed values (e.g. NumPy
+                arrays) are read-only.  Requires pickle protocol 5 or higher.
+                Defaults to False.
+            compression: The compression codec to use, one of 'zlib', 'bz2',
+                'lzma', or None (the default) for no compression
+            level: The compression level, or None to use the codec's default
+            threshold: The minimum size in bytes of serialized values which
+                will be compressed.  Compressed values which are not smaller
+                than the original are stored uncompressed.
+        """
+        # Validate arguments
+        if out_of_band and protocol < 5:
+            raise ValueError('out-of-band buffers require pickle protocol 5')
+        if compression not in _CODECS:
+            raise ValueError('unsupported compression codec: {0}'.format(
+                compression
+            ))
+
+        # Store the configuration
+        self._protocol = protocol
+        self._out_of_band = out_of_band
+        self._codec, self._compress, _ = _CODECS[compression]
+        self._level = _DEFAULT_LEVELS.get(compression) if level is None \
+            else level
+        self._threshold = threshold
+
+    def _body(self, value):
+        """Creates the uncompressed body for a value.
+
+        Args:
+            value: The value to serialize
+
+        Returns:
+            A tuple of the form (flags, list of body byte strings).
+        """
+        # Handle in-band pickling
+        if not self._out_of_band:
+            return 0, [pickle.dumps(value, protocol = self._protocol)]
+
+        # Otherwise collect buffers out-of-band
+        buffers = []
+        data = pickle.dumps(
+            value,
+            protocol = self._protocol,
+            buffer_callback = buffers.append
+        )
+        buffers = [b.raw() for b in buffers]
+        parts = [_COUNT.pack(len(buffers)), _LENGTH.pack(len(data))]
+        parts.extend(_LENGTH.pack(b.nbytes) for b in buffers)
+        parts.append(data)
+        parts.extend(buffers)
+        return _FLAG_OUT_OF_BAND, parts
+
+    def dumps(self, value):
+        """Serializes a value.
+
+        Args:
+            value: The value to serialize
+
+        Returns:
+            The serialized value, as a byte string.
+        """
+        return self._encode(*self._body(value))
+
+    def _encode(self, flags, parts):
+        """Encodes a body, compressing it if worthwhile.
+
+        Args:
+            flags: The body flags
+            parts: The list of body byte strings
+
+        Returns:
+            The serialized value, as a byte string.
+        """
+        # Compress the body if worthwhile
+        body = b''.join(parts)
+        codec = 0
+        if self._codec and len(body) >= self._threshold:
+            compressed = self._compress(body, self._level)
+            if len(compressed) < len(body):
+                codec, body = self._codec, compressed
+
+        # Add the header
+        return MAGIC + bytes(bytearray((codec, flags))) + body
+
+    def dump(self, value, f):
+        """Serializes a value to a file.
+
+        Uncompressed values are written piecewise, so that out-of-band
+        buffers are written directly from the original objects.
+
+        Args:
+            value: The value to serialize
+            f: The binary file object to write to
+        """
+        # Check if the value would be compressed
+        flags, parts = self._body(value)
+        if self._codec and sum(len(p) for p in parts) >= self._threshold:
+            f.write(self._encode(flags, parts))
+            return
+
+        # Otherwise write the parts as they are
+        f.write(MAGIC + bytes(bytearray((0, flags))))
+        for part in parts:
+            f.write(part)
+
+    def loads(self, data):
+        """Deserializes a value.
+
+        Args:
+            data: The serialized value, as a bytes-like object
+
+        Returns:
+            The value.
+        """
+        return loads(data)
+
+    def load(self, f):
+        """Deserializes a value from a file.
+
+        Args:
+            f: The binary file object to read from
+
+        Returns:
+            The value.
+        """
+        return load(f)
+
+
+# The length of the header
+_HEADER_LENGTH = len(MAGIC) + 2
+
+
+def _decode(codec, flags, body):
+    """Decodes the body of a serialized value.
+
+    Args:
+        codec: The codec identifier from the header
+        flags: The flags from the header
+        body: The body, as a memoryview
+
+    Returns:
+        The value.
+    """
+    # Decompress the body if necessary
+    if codec:
+        decompress = _DECOMPRESSORS.get(codec)
+        if decompress is None:
+            raise ValueError('unsupported compression codec: {0}'.format(
+                codec
+            ))
+        body = memoryview(decompress(body))
+
+    # Handle in-band bodies
+    if not flags & _FLAG_OUT_OF_BAND:
+        return pickle.loads(body)
+
+    # Decode out-of-band bodies, referencing the buffers without copying
+    count = _COUNT.unpack_from(body)[0]
+    offset = _COUNT.size
+    data_length = _LENGTH.unpack_from(body, offset)[0]
+    offset += _LENGTH.size
+    lengths = [_LENGTH.unpack_from(body, offset + i * _LENGTH.size)[0]
+               for i in range(count)]
+    offset += count * _LENGTH.size
+    data = body[offset:offset + data_length]
+    offset += data_length
+    buffers = []
+    for length in lengths:
+        buffers.append(body[offset:offset + length])
+        offset += length
+    return pickle.loads(data, buffers = buffers)
+
+
+def loads(data):
+    """Deserializes a value written by any serializer configuration, or by
+    plain pickling.
+
+    Args:
+        data: The serialized value, as a bytes-like object
+
+    Returns:
+        The value.
+    """
+    # Handle values without a header
+    data = memoryview(data)
+    if data[:len(MAGIC)] != MAGIC:
+        return pickle.loads(data)
+
+    # Decode the value
+    codec, flags = bytearray(data[len(MAGIC):_HEADER_LENGTH])
+    return _decode(codec, flags, data[_HEADER_LENGTH:])
+
+
+def load(f):
+    """Deserializes a value written by any serializer configuration, or by
+    plain pickling, from a file.
+
+    Uncompressed values without out-of-band buffers are unpickled directly from
+    the file, without reading it into memory first.
+
+    Args:
+        f: The binary file object to read from, which must be seekable
+
+    Returns:
+        The value.
+    """
+    # Handle values without a header
+    header = f.read(_HEADER_LENGTH)
+    if header[:len(MAGIC)] != MAGIC:
+        f.seek(-len(header), 1)
+        return pickle.load(f)
+
+    # Decode the value, streaming it if possible
+    codec, flags = bytearray(header[len(MAGIC):])
+    if not codec and not flags:
+        return pickle.load(f)
+    return _decode(codec, flags, memoryview(f.read()))
+
+
+# The default serializer used by persistent backends
+default_serializer = PickleSerializer()
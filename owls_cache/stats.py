@@ -0,0 +1,136 @@
+"""Provides statistics collection for caches and caching backends.
+"""
+
+
+# System imports
+from contextlib import contextmanager
+from timeit import default_timer
+import threading
+
+
+class LatencyHistogram(object):
+    """A histogram of operation latencies with logarithmically-spaced buckets.
+
+    Bucket i counts latencies in the range [2^(i-1), 2^i) microseconds, with
+    the first bucket counting everything below one microsecond and the last
+    bucket counting everything above the largest bound.
+    """
+
+    # The number of buckets (the last bound is roughly 35 minutes)
+    BUCKETS = 32
+
+    def __init__(self):
+        """Initializes a new instance of the LatencyHistogram class.
+        """
+        self.reset()
+
+    def reset(self):
+        """Clears all recorded latencies.
+        """
+        self.counts = [0] * self.BUCKETS
+        self.count = 0
+        self.total = 0.0
+
+    def record(self, seconds):
+        """Records a latency.
+
+        Args:
+            seconds: The latency, in seconds
+        """
+        microseconds = int(seconds * 1e6)
+        self.counts[min(microseconds.bit_length(), self.BUCKETS - 1)] += 1
+        self.count += 1
+        self.total += seconds
+
+    def snapshot(self):
+        """Returns a snapshot of the histogram.
+
+        Returns:
+            A dictionary with the total number of operations ('count'), their
+            total duration in seconds ('total'), and a list of the
+            non-empty buckets ('buckets') as (upper bound in seconds, count)
+            tuples, with an upper bound of None for the overflow bucket.
+        """
+        buckets = []
+        for i, n in enumerate(self.counts):
+            if n:
+                bound = (2 ** i) / 1e6 if i < self.BUCKETS - 1 else None
+                buckets.append((bound, n))
+        return {'count': self.count, 'total': self.total, 'buckets': buckets}
+
+
+class CacheStatistics(object):
+    """Collects hit, miss, eviction, timing, and traffic statistics for a cache
+    or caching backend.
+
+    All methods are thread-safe.
+    """
+
+    # The names of the plain counters
+    COUNTERS = ('hits', 'misses', 'evictions', 'bytes_read', 'bytes_written')
+
+    # The names of the latency histograms
+    HISTOGRAMS = ('compute', 'get', 'set')
+
+    def __init__(self):
+        """Initializes a new instance of the CacheStatistics class.
+        """
+        self._lock = threading.Lock()
+        self._histograms = dict((n, LatencyHistogram())
+                                for n in self.HISTOGRAMS)
+        self.reset()
+
+    def reset(self):
+        """Resets all statistics to zero.
+        """
+        with self._lock:
+            self._counters = dict.fromkeys(self.COUNTERS, 0)
+            for histogram in self._histograms.values():
+                histogram.reset()
+
+    def count(self, counter, amount = 1):
+        """Increments a counter.
+
+        Args:
+            counter: The name of the counter (one of `COUNTERS`)
+            amount: The amount by which to increment
+        """
+        with self._lock:
+            self._counters[counter] += amount
+
+    def record(self, histogram, seconds):
+        """Records a latency.
+
+        Args:
+            histogram: The name of the histogram (one of `HISTOGRAMS`)
+            seconds: The latency, in seconds
+        """
+        with self._lock:
+            self._histograms[histogram].record(seconds)
+
+    @contextmanager
+    def timing(self, histogram):
+        """Provides a context manager which records the latency of the code it
+        wraps.
+
+        Args:
+            histogram: The name of the histogram (one of `HISTOGRAMS`)
+        """
+        start = default_timer()
+        try:
+            yield
+        finally:
+            self.record(histogram, default_timer() - start)
+
+    def snapshot(self):
+        """Returns a consistent snapshot of the statistics.
+
+        Returns:
+            A dictionary mapping counter names to their values and histogram
+            names to histogram snapshots (see `LatencyHistogram.snapshot`).
+        """
+        with self._lock:
+            result = dict(self._counters)
+            for name, histogram in self._histograms.items():
+                result[name] = histogram.snapshot()
+        return result
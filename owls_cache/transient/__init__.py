@@ -0,0 +1,544 @@
+"""Provides transient caching facilities via the @cached decorator.
+"""
+
+
+# System imports
+from functools import wraps
+from itertools import count
+from weakref import WeakSet
+import threading
+import logging
+
+# Six imports
+from six import iteritems, itervalues
+
+# owls-cache imports
+from owls_cache.stats import CacheStatistics
+from owls_cache.transient.sizing import default_sizer
+from owls_cache.transient.policies import create_policy
+
+
+# Global transient caching logger (with debug disabled by default)
+_cache_log = logging.getLogger(__name__)
+_cache_log.setLevel(logging.INFO)
+
+
+def set_cache_debug(debug = True):
+    """Sets whether or not to print debugging information for transient cache
+    hits/misses.
+
+    Args:
+        debug: Whether or not to print debugging information
+    """
+    _cache_log.setLevel(logging.DEBUG if debug else logging.INFO)
+
+
+class _Flight(object):
+    """Represents an in-flight computation of a cache value, on which other
+    threads missing on the same key can wait.
+    """
+
+    def __init__(self):
+        """Initializes a new instance of the _Flight class.
+        """
+        self._done = threading.Event()
+        self._result = None
+        self._error = None
+
+    def finish(self, result = None, error = None):
+        """Publishes the outcome of the computation and wakes all waiters.
+
+        Args:
+            result: The computed value
+            error: The exception raised by the computation, if any
+        """
+        self._result = result
+        self._error = error
+        self._done.set()
+
+    def wait(self):
+        """Waits for the computation to complete.
+
+        Returns:
+            The computed value.
+
+        Raises:
+            The exception raised by the computation, if any.
+        """
+        self._done.wait()
+        if self._error is not None:
+            raise self._error
+        return self._result
+
+
+class _GlobalBudget(object):
+    """Tracks the total resident size of all byte-accounted transient caches
+    in the process and enforces a global byte budget across them.
+
+    When the budget is exceeded, entries are evicted from whichever cache holds
+    the globally least-recently-used entry until the total fits again.
+    """
+
+    def __init__(self):
+        """Initializes a new instance of the _GlobalBudget class.
+        """
+        self._lock = threading.Lock()
+        self._caches = WeakSet()
+        self.max_bytes = None
+        self.total_bytes = 0
+
+    def register(self, cache):
+        """Registers a cache with the budget.
+
+        Args:
+            cache: The cache to register
+        """
+        with self._lock:
+            self._caches.add(cache)
+
+    def adjust(self, delta):
+        """Adjusts the total resident size.
+
+        Args:
+            delta: The change in size, in bytes
+        """
+        if delta:
+            with self._lock:
+                self.total_bytes += delta
+
+    def enforce(self):
+        """Evicts entries until the total resident size fits in the budget.
+        """
+        while True:
+            # Check if we're within budget
+            with self._lock:
+                if self.max_bytes is None \
+                        or self.total_bytes <= self.max_bytes:
+                    return
+                caches = list(self._caches)
+
+            # Find the cache holding the globally oldest entry.  We only ever
+            # hold one cache lock at a time to avoid lock-ordering issues.
+            victim = None
+            victim_tick = None
+            for cache in caches:
+                tick = cache.oldest_tick()
+                if tick is not None and (victim is None or tick < victim_tick):
+                    victim, victim_tick = cache, tick
+
+            # If nothing is evictable, there's nothing more we can do
+            if victim is None or not victim.evict_oldest():
+                return
+
+
+# The process-wide byte budget shared by all transient caches
+_global_budget = _GlobalBudget()
+
+
+def set_global_byte_budget(max_bytes):
+    """Sets the maximum total number of bytes which may be held by all
+    transient caches in the process.
+
+    Only values stored while a byte budget (global or per-cache) is in effect
+    are sized and accounted.
+
+    Args:
+        max_bytes: The maximum number of bytes, or None for no limit
+    """
+    _global_budget.max_bytes = max_bytes
+    _global_budget.enforce()
+
+
+# A process-wide counter used to order cache entries by recency across caches
+_ticks = count()
+
+
+class _Cache(object):
+    """A thread-safe cache which coalesces concurrent misses for the same key
+    into a single computation.
+
+    Each cache may be bounded by a number of entries and/or a number of bytes,
+    and also participates in the process-wide byte budget.  Which entries are
+    evicted to respect these bounds is decided by the cache's eviction policy.
+    """
+
+    def __init__(self, sizer, policy, statistics):
+        """Initializes a new instance of the _Cache class.
+
+        Args:
+            sizer: The callable used to estimate the size of values in bytes
+            policy: The EvictionPolicy instance to use
+            statistics: The CacheStatistics instance to record into
+        """
+        self._lock = threading.Lock()
+        self._entries = {}
+        self._flights = {}
+        self._sizer = sizer
+        self._policy = policy
+        self._statistics = statistics
+        self.total_bytes = 0
+        _global_budget.register(self)
+
+    def __len__(self):
+        """Returns the number of cached values.
+        """
+        return len(self._entries)
+
+    def __contains__(self, key):
+        """Returns whether or not a value is cached for the key.
+        """
+        return key in self._entries
+
+    def clear(self):
+        """Removes all cached values.
+        """
+        with self._lock:
+            self._entries.clear()
+            self._policy.clear()
+            released = self.total_bytes
+            self.total_bytes = 0
+        _global_budget.adjust(-released)
+
+    def oldest_tick(self):
+        """Returns the recency tick of the entry which the policy would evict
+        next, or None if the cache holds no byte-accounted entries.
+        """
+        with self._lock:
+            if not self.total_bytes:
+                return None
+            return self._entries[self._policy.victim()][2]
+
+    def evict_oldest(self):
+        """Evicts the entry chosen by the policy.
+
+        Returns:
+            True if an entry was evicted, False if the cache was empty.
+        """
+        with self._lock:
+            if not self._entries:
+                return False
+            released = self._evict()
+        _global_budget.adjust(-released)
+        return True
+
+    def _evict(self, incoming = None):
+        """Evicts the entry chosen by the policy.  The cache lock must be held.
+
+        Args:
+            incoming: The key for which room is being made, if any
+
+        Returns:
+            The number of bytes released.
+        """
+        _, size, _ = self._entries.pop(self._policy.evict(incoming))
+        self.total_bytes -= size
+        self._statistics.count('evictions')
+        return size
+
+    def lookup(self, key, compute, size, max_bytes):
+        """Looks up the value for a key, computing it on a miss.
+
+        If another thread is already computing the value for the same key, then
+        this method waits for that computation rather than starting another.
+
+        Args:
+            key: The cache key
+            compute: A callable of no arguments which computes the value
+            size: The maximum number of values to retain, or None for no
+                limit
+            max_bytes: The maximum total size of values to retain, in bytes,
+                or None for no limit
+
+        Returns:
+            A tuple of the form (value, hit), where hit indicates whether or
+            not the value was found in the cache or computed by another thread.
+        """
+        # Check for a hit or an in-flight computation
+        with self._lock:
+            entries = self._entries
+            if key in entries:
+                # Record the access
+                result, nbytes, _ = entries[key]
+                entries[key] = (result, nbytes, next(_ticks))
+                self._policy.access(key)
+                hit = True
+            else:
+                hit = False
+                flight = self._flights.get(key)
+                leader = flight is None
+                if leader:
+                    flight = self._flights[key] = _Flight()
+        if hit:
+            self._statistics.count('hits')
+            return result, True
+
+        # If somebody else is doing the work, wait for them
+        if not leader:
+            result = flight.wait()
+            self._statistics.count('hits')
+            return result, True
+
+        # Otherwise do the hard work
+        self._statistics.count('misses')
+        try:
+            with self._statistics.timing('compute'):
+                result = compute()
+
+            # Size the result if any byte budget is in effect
+            if max_bytes is not None \
+                    or _global_budget.max_bytes is not None:
+                nbytes = self._sizer(result)
+            else:
+                nbytes = 0
+        except BaseException as e:
+            with self._lock:
+                del self._flights[key]
+            flight.finish(error = e)
+            raise
+
+        # Store the value, shrinking the cache to fit any limits.  Values which
+        # could never fit are not stored at all.
+        delta = 0
+        with self._lock:
+            self._policy.capacity = size
+            fits = (size is None or size > 0) \
+                and (max_bytes is None or nbytes <= max_bytes)
+            if fits:
+                while entries and (
+                    (size is not None and len(entries) >= size) or
+                    (max_bytes is not None and
+                     self.total_bytes + nbytes > max_bytes)
+                ):
+                    delta -= self._evict(key)
+                entries[key] = (result, nbytes, next(_ticks))
+                self._policy.insert(key)
+                self.total_bytes += nbytes
+                delta += nbytes
+            del self._flights[key]
+
+        # Update the global accounting
+        _global_budget.adjust(delta)
+        _global_budget.enforce()
+
+        # Wake up any waiters
+        flight.finish(result)
+
+        # All done
+        return result, False
+
+
+class _CacheMap(dict):
+    """A dictionary mapping cache names to caches, which creates caches on
+    demand in a thread-safe manner.
+
+    Removing a cache from the map empties it.
+    """
+
+    def __init__(self, sizer, policy, statistics):
+        """Initializes a new instance of the _CacheMap class.
+
+        Args:
+            sizer: The callable used by created caches to size values
+            policy: The default eviction policy (name or factory) for created
+                caches
+            statistics: The CacheStatistics instance shared by created caches
+        """
+        super(_CacheMap, self).__init__()
+        self._lock = threading.Lock()
+        self._sizer = sizer
+        self._policy = policy
+        self._statistics = statistics
+
+    def __missing__(self, name):
+        """Creates the cache for a name which is not yet present, using the
+        default eviction policy.
+
+        Args:
+            name: The cache name
+
+        Returns:
+            The cache.
+        """
+        return self.cache(name)
+
+    def cache(self, name, policy = None):
+        """Gets the cache for a name, creating it if it is not yet present.
+
+        Args:
+            name: The cache name
+            policy: The eviction policy (name or factory) to use if the cache
+                is created, or None to use the default policy
+
+        Returns:
+            The cache.
+        """
+        cache = self.get(name)
+        if cache is not None:
+            return cache
+        with self._lock:
+            cache = self.get(name)
+            if cache is None:
+                cache = self[name] = _Cache(
+                    self._sizer,
+                    create_policy(self._policy if policy is None else policy),
+                    self._statistics
+                )
+            return cache
+
+    def __delitem__(self, name):
+        """Removes and empties the cache for a name.
+
+        Args:
+            name: The cache name
+        """
+        self.pop(name)
+
+    def pop(self, name, *default):
+        """Removes and empties the cache for a name.
+
+        Args:
+            name: The cache name
+            default: The value to return if the name is not present
+
+        Returns:
+            The (emptied) cache.
+        """
+        with self._lock:
+            cache = super(_CacheMap, self).pop(name, *default)
+        if isinstance(cache, _Cache):
+            cache.clear()
+        return cache
+
+    def clear(self):
+        """Removes and empties all caches.
+        """
+        with self._lock:
+            caches = list(itervalues(self))
+            super(_CacheMap, self).clear()
+        for cache in caches:
+            cache.clear()
+
+
+def cached(mapper = lambda *args, **kwargs: args + tuple(iteritems(kwargs)),
+           sizer = default_sizer,
+           policy = 'lru'):
+    """Decorator to create a transiently-cached version of a function.
+
+    The function can have an unlimited number of caches associated with it -
+    one of which is the default cache and others of which can be named with the
+    added `cache` keyword argument.  This allows users to associate caches with
+    call-sites rather than just functions, and allows users of code with
+    transient caching embedded to more effectively control caching on a
+    per-call-site basis.
+
+    Cache purging is on a Least-Recently-Used basis by default, but other
+    eviction policies may be selected per decorated function or per named
+    cache (see `owls_cache.transient.policies`).  Caches are safe to use
+    from multiple threads, and concurrent misses for the same key within a
+    cache result in only a single invocation of the underlying function, with
+    other callers waiting for and sharing its result.
+
+    The resulting function will take two additional optional keyword arguments:
+
+        cache: The name of the cache in which to store objects (defaults to the
+            function name).  This value must be a string.  If None is provided,
+            then caching is disabled for that call.
+        cache_size: The maximum allowable size for the cache, in terms of
+            number of objects.  Pass None for no size restriction.  Defaults to
+            5.
+        cache_bytes: The maximum allowable size for the cache, in terms of
+            the estimated number of bytes held by its objects.  Pass None (the
+            default) for no byte restriction.  Objects larger than this limit
+            are not cached.
+        cache_policy: The eviction policy (name or factory) to use for the
+            cache.  This only takes effect when the named cache is first
+            created.  Defaults to the policy given to the decorator.
+
+    In addition to any per-cache limits, all caches are subject to the global
+    byte budget set with `set_global_byte_budget`.
+
+    The resulting function will also have a `caches` attribute, which is a
+    special dictionary mapping cache names to the caches themselves.  Names can
+    be removed from the dictionary to empty that cache, or the dictionary can
+    be cleared to empty all associated caches.  Its `statistics` attribute is
+    a CacheStatistics instance which records hits, misses, evictions, and
+    computation times across all of the function's caches.
+
+    Args:
+        mapper: A function which accepts the same arguments as the underlying
+            function and maps them to a hashable tuple of values, which will
+            then be hashed to act as the cache key.  If the argument types to
+            the underlying function are not hashable (e.g. they are lists or
+            dictionaries), then this function provides a mechanism by which to
+            convert them to hashable types (e.g. tuples).  Defaults to a
+            function which concatenates args and kwargs into a tuple.
+        sizer: A function which accepts a cached value and returns an estimate
+            of its size in bytes, used when a byte budget is in effect.  See
+            `owls_cache.transient.sizing` for the available sizers.  Defaults
+            to `recursive_sizer`.
+        policy: The default eviction policy for the function's caches, either
+            a name ('lru', 'lfu', 'arc', or 'w-tinylfu') or a callable
+            returning an EvictionPolicy instance.  Defaults to 'lru'.
+
+    Returns:
+        A cached version of the callable.
+    """
+    # Create the decorator
+    def decorator(f):
+        # Create the caches for the function
+        statistics = CacheStatistics()
+        caches = _CacheMap(sizer, policy, statistics)
+
+        # Create the wrapper function
+        @wraps(f)
+        def wrapper(*args, **kwargs):
+            # Extract keyword arguments if specified
+            cache_name = kwargs.pop('cache', '')
+            cache_size = kwargs.pop('cache_size', 5)
+            cache_bytes = kwargs.pop('cache_bytes', None)
+            cache_policy = kwargs.pop('cache_policy', None)
+
+            # Get the value which will be used as a key for this cache
+            identifier = mapper(*args, **kwargs)
+
+            # Check if caching is disabled
+            if cache_name is None:
+                _cache_log.debug(
+                    'caching disabled for %s in %s',
+                    identifier,
+                    f.__name__
+                )
+                return f(*args, **kwargs)
+
+            # Grab the cache
+            cache = caches.cache(cache_name, cache_policy)
+
+            # Look up the value, doing the hard work if necessary
+            result, hit = cache.lookup(
+                identifier,
+                lambda: f(*args, **kwargs),
+                cache_size,
+                cache_bytes
+            )
+
+            # Log the cache hit or miss
+            _cache_log.debug(
+                'cache %s for %s in %s with %s',
+                'hit' if hit else 'miss',
+                identifier,
+                f.__name__,
+                cache_name
+            )
+
+            # All done
+            return result
+
+        # Set the caches and statistics attributes
+        wrapper.caches = caches
+        wrapper.statistics = statistics
+
+        # Return the wrapper function
+        return wrapper
+
+    # Return the decorator
+    return decorator
@@ -0,0 +1,473 @@
+"""Provides eviction policies for transient caches.
+
+An eviction policy tracks the keys held by a cache and decides which of them
+to discard when the cache needs room.  Policies are not thread-safe on their
+own; caches serialize all calls into them.
+"""
+
+
+# System imports
+from collections import OrderedDict, defaultdict
+from random import Random
+
+
+class EvictionPolicy(object):
+    """The base eviction policy.  This policy should be subclassed by concrete
+    implementations.
+
+    The `capacity` attribute holds the maximum number of entries of the
+    associated cache (or None if unbounded) and is kept up to date by the
+    cache.  Policies may use it to size their internal structures.
+    """
+
+    # The capacity hint for the cache
+    capacity = None
+
+    def access(self, key):
+        """Records a cache hit for a key.
+
+        Args:
+            key: The key which was accessed
+        """
+        raise NotImplementedError('abstract method')
+
+    def insert(self, key):
+        """Records the insertion of a new key.
+
+        Args:
+            key: The key which was inserted
+        """
+        raise NotImplementedError('abstract method')
+
+    def victim(self, incoming = None):
+        """Returns the key which would be evicted next, without evicting it.
+
+        Args:
+            incoming: The key for which room is being made, if any
+
+        Returns:
+            The key, or None if the policy tracks no keys.
+        """
+        raise NotImplementedError('abstract method')
+
+    def evict(self, incoming = None):
+        """Evicts the next key.
+
+        Args:
+            incoming: The key for which room is being made, if any
+
+        Returns:
+            The evicted key.
+        """
+        raise NotImplementedError('abstract method')
+
+    def remove(self, key):
+        """Forgets a key which has been removed from the cache other than by
+        eviction.
+
+        Args:
+            key: The key to forget
+        """
+        raise NotImplementedError('abstract method')
+
+    def clear(self):
+        """Forgets all keys.
+        """
+        raise NotImplementedError('abstract method')
+
+
+class LRUPolicy(EvictionPolicy):
+    """Evicts the least-recently-used key.
+    """
+
+    def __init__(self):
+        """Initializes a new instance of the LRUPolicy class.
+        """
+        self._order = OrderedDict()
+
+    def access(self, key):
+        self._order[key] = self._order.pop(key)
+
+    def insert(self, key):
+        self._order[key] = None
+
+    def victim(self, incoming = None):
+        return next(iter(self._order), None)
+
+    def evict(self, incoming = None):
+        return self._order.popitem(last = False)[0]
+
+    def remove(self, key):
+        self._order.pop(key, None)
+
+    def clear(self):
+        self._order.clear()
+
+
+class LFUPolicy(EvictionPolicy):
+    """Evicts the least-frequently-used key, breaking ties by recency.
+
+    All operations are O(1).
+    """
+
+    def __init__(self):
+        """Initializes a new instance of the LFUPolicy class.
+        """
+        self._frequencies = {}
+        self._buckets = defaultdict(OrderedDict)
+        self._minimum = 0
+
+    def _unlink(self, key):
+        """Removes a key from its frequency bucket.
+
+        Args:
+            key: The key to unlink
+
+        Returns:
+            The frequency of the key.
+        """
+        frequency = self._frequencies.pop(key)
+        bucket = self._buckets[frequency]
+        del bucket[key]
+        if not bucket:
+            del self._buckets[frequency]
+        return frequency
+
+    def access(self, key):
+        frequency = self._unlink(key)
+        if frequency == self._minimum and frequency not in self._buckets:
+            self._minimum += 1
+        self._frequencies[key] = frequency + 1
+        self._buckets[frequency + 1][key] = None
+
+    def insert(self, key):
+        self._frequencies[key] = 1
+        self._buckets[1][key] = None
+        self._minimum = 1
+
+    def victim(self, incoming = None):
+        if not self._frequencies:
+            return None
+        if self._minimum not in self._buckets:
+            self._minimum = min(self._buckets)
+        return next(iter(self._buckets[self._minimum]))
+
+    def evict(self, incoming = None):
+        key = self.victim()
+        self._unlink(key)
+        return key
+
+    def remove(self, key):
+        if key in self._frequencies:
+            self._unlink(key)
+
+    def clear(self):
+        self._frequencies.clear()
+        self._buckets.clear()
+        self._minimum = 0
+
+
+class ARCPolicy(EvictionPolicy):
+    """Implements the Adaptive Replacement Cache policy of Megiddo and Modha.
+
+    Keys seen once live in a recency list and keys seen more than once live in
+    a frequency list.  Ghost lists of recently evicted keys adapt the balance
+    between the two, so that one-off scans cannot flush frequently-used keys.
+    """
+
+    def __init__(self):
+        """Initializes a new instance of the ARCPolicy class.
+        """
+        self._t1 = OrderedDict()
+        self._t2 = OrderedDict()
+        self._b1 = OrderedDict()
+        self._b2 = OrderedDict()
+        self._p = 0.0
+
+    def _target(self):
+        """Returns the effective capacity used for adaptation.
+        """
+        if self.capacity is not None:
+            return self.capacity
+        return max(len(self._t1) + len(self._t2), 1)
+
+    def access(self, key):
+        self._t1.pop(key, None)
+        self._t2.pop(key, None)
+        self._t2[key] = None
+
+    def insert(self, key):
+        # Adapt the target size of the recency list if this key was recently
+        # evicted, promoting it straight to the frequency list
+        c = self._target()
+        if key in self._b1:
+            delta = max(len(self._b2) / float(len(self._b1)), 1.0)
+            self._p = min(float(c), self._p + delta)
+            del self._b1[key]
+            self._t2[key] = None
+        elif key in self._b2:
+            delta = max(len(self._b1) / float(len(self._b2)), 1.0)
+            self._p = max(0.0, self._p - delta)
+            del self._b2[key]
+            self._t2[key] = None
+        else:
+            self._t1[key] = None
+
+        # Bound the ghost lists
+        while len(self._b1) + len(self._b2) > c:
+            if len(self._b1) > len(self._b2):
+                self._b1.popitem(last = False)
+            else:
+                self._b2.popitem(last = False)
+
+    def _evict_from_t1(self, incoming):
+        """Determines whether the next victim comes from the recency list.
+
+        Args:
+            incoming: The key for which room is being made, if any
+        """
+        if not self._t1:
+            return False
+        if not self._t2:
+            return True
+        return len(self._t1) > self._p or \
+            (incoming in self._b2 and len(self._t1) == int(self._p))
+
+    def victim(self, incoming = None):
+        source = self._t1 if self._evict_from_t1(incoming) else self._t2
+        return next(iter(source), None)
+
+    def evict(self, incoming = None):
+        if self._evict_from_t1(incoming):
+            key = self._t1.popitem(last = False)[0]
+            self._b1[key] = None
+        else:
+            key = self._t2.popitem(last = False)[0]
+            self._b2[key] = None
+        return key
+
+    def remove(self, key):
+        self._t1.pop(key, None)
+        self._t2.pop(key, None)
+
+    def clear(self):
+        self._t1.clear()
+        self._t2.clear()
+        self._b1.clear()
+        self._b2.clear()
+        self._p = 0.0
+
+
+class _FrequencySketch(object):
+    """A count-min sketch of approximate key frequencies with periodic aging,
+    as used by TinyLFU.
+    """
+
+    # The number of hash rows
+    _DEPTH = 4
+
+    # The saturation value of each counter
+    _MAXIMUM = 15
+
+    def __init__(self, width):
+        """Initializes a new instance of the _FrequencySketch class.
+
+        Args:
+            width: The number of counters per row
+        """
+        self._width = max(width, 16)
+        self._rows = [[0] * self._width for _ in range(self._DEPTH)]
+        seeds = Random(0x5eed)
+        self._seeds = [seeds.getrandbits(32) for _ in range(self._DEPTH)]
+        self._sample_size = 10 * self._width
+        self._additions = 0
+
+    def _indices(self, key):
+        """Computes the counter index of a key in each row.
+
+        Args:
+            key: The key
+
+        Returns:
+            A list of indices, one per row.
+        """
+        h = hash(key)
+        return [hash((seed, h)) % self._width for seed in self._seeds]
+
+    def increment(self, key):
+        """Records an occurrence of a key.
+
+        Args:
+            key: The key
+        """
+        for row, index in zip(self._rows, self._indices(key)):
+            if row[index] < self._MAXIMUM:
+                row[index] += 1
+
+        # Age all counters once enough samples have been recorded, so that
+        # historical popularity decays
+        self._additions += 1
+        if self._additions >= self._sample_size:
+            self._additions //= 2
+            for row in self._rows:
+                for i in range(self._width):
+                    row[i] >>= 1
+
+    def estimate(self, key):
+        """Estimates the frequency of a key.
+
+        Args:
+            key: The key
+
+        Returns:
+            The estimated number of recent occurrences.
+        """
+        return min(row[index]
+                   for row, index
+                   in zip(self._rows, self._indices(key)))
+
+
+class WTinyLFUPolicy(EvictionPolicy):
+    """Implements the Window TinyLFU policy of Einziger, Friedman and Manes.
+
+    New keys enter a small LRU admission window.  Keys leaving the window are
+    only admitted into the main segmented-LRU region if a frequency sketch
+    estimates them to be more popular than the main region's victim, which
+    makes the policy resistant to scans while still adapting to recency.
+    """
+
+    def __init__(self, window_fraction = 0.01, protected_fraction = 0.8,
+                 sketch_width = 4096):
+        """Initializes a new instance of the WTinyLFUPolicy class.
+
+        Args:
+            window_fraction: The fraction of the capacity devoted to the
+                admission window
+            protected_fraction: The fraction of the main region devoted to
+                keys which have been accessed more than once
+            sketch_width: The number of counters per row of the frequency
+                sketch, used if the cache has no capacity
+        """
+        self._window_fraction = window_fraction
+        self._protected_fraction = protected_fraction
+        self._sketch_width = sketch_width
+        self._sketch = None
+        self._window = OrderedDict()
+        self._probation = OrderedDict()
+        self._protected = OrderedDict()
+
+    def _record(self, key):
+        """Records an occurrence of a key in the frequency sketch.
+
+        Args:
+            key: The key
+        """
+        if self._sketch is None:
+            width = self._sketch_width if self.capacity is None \
+                else 4 * self.capacity
+            self._sketch = _FrequencySketch(width)
+        self._sketch.increment(key)
+
+    def _size(self):
+        """Returns the effective capacity used to size the regions.
+        """
+        if self.capacity is not None:
+            return self.capacity
+        return len(self._window) + len(self._probation) + len(self._protected)
+
+    def access(self, key):
+        self._record(key)
+        if key in self._window:
+            self._window[key] = self._window.pop(key)
+        elif key in self._protected:
+            self._protected[key] = self._protected.pop(key)
+        else:
+            # Promote from probation, demoting the oldest protected key if the
+            # protected region is full
+            del self._probation[key]
+            self._protected[key] = None
+            limit = max(int(self._protected_fraction * self._size()), 1)
+            while len(self._protected) > limit:
+                demoted = self._protected.popitem(last = False)[0]
+                self._probation[demoted] = None
+
+    def insert(self, key):
+        self._record(key)
+        self._window[key] = None
+
+        # Move keys which overflow the window into probation, where they will
+        # compete for admission when room is needed
+        limit = max(int(self._window_fraction * self._size()), 1)
+        while len(self._window) > limit:
+            moved = self._window.popitem(last = False)[0]
+            self._probation[moved] = None
+
+    def _main_victim(self):
+        """Returns the next victim of the main region, if any.
+        """
+        for region in (self._probation, self._protected):
+            for key in region:
+                return key
+        return None
+
+    def _candidate(self):
+        """Returns the newest probationary key, which has yet to prove itself
+        against the main region's victim.
+        """
+        return next(reversed(self._probation)) if self._probation else None
+
+    def victim(self, incoming = None):
+        # If there's nothing in the main region beyond the candidate, then
+        # simply evict from the window
+        candidate = self._candidate()
+        victim = self._main_victim()
+        if candidate is None or candidate == victim:
+            if victim is not None:
+                return victim
+            return next(iter(self._window), None)
+
+        # Otherwise let the candidate and victim duel on frequency
+        if self._sketch.estimate(candidate) > self._sketch.estimate(victim):
+            return victim
+        return candidate
+
+    def evict(self, incoming = None):
+        key = self.victim(incoming)
+        self.remove(key)
+        return key
+
+    def remove(self, key):
+        for region in (self._window, self._probation, self._protected):
+            if key in region:
+                del region[key]
+                return
+
+    def clear(self):
+        self._window.clear()
+        self._probation.clear()
+        self._protected.clear()
+        self._sketch = None
+
+
+# A mapping of policy names to policy classes
+POLICIES = {
+    'lru': LRUPolicy,
+    'lfu': LFUPolicy,
+    'arc': ARCPolicy,
+    'w-tinylfu': WTinyLFUPolicy,
+}
+
+
+def create_policy(policy):
+    """Creates an eviction policy instance.
+
+    Args:
+        policy: Either a name from `POLICIES` or a callable of no arguments
+            returning an EvictionPolicy instance (e.g. a policy class)
+
+    Returns:
+        The policy instance.
+    """
+    if policy in POLICIES:
+        policy = POLICIES[policy]
+    return policy()
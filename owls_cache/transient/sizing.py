@@ -0,0 +1,111 @@
+"""Provides sizers for estimating the memory footprint of cached values.
+
+A sizer is any callable which accepts a value and returns an estimate of the
+number of bytes it occupies.  Sizers are used by transient caches with byte
+budgets to decide what to evict.
+"""
+
+
+# System imports
+import sys
+
+# Six imports
+from six import integer_types, itervalues, string_types
+
+
+def _buffer_size(value):
+    """Computes the size of a value's data buffer, if it has one.
+
+    Args:
+        value: The value to inspect
+
+    Returns:
+        The size of the data buffer in bytes, or None if the value does not
+        expose a buffer.
+    """
+    # Check for NumPy-style arrays and other objects which advertise their size
+    nbytes = getattr(value, 'nbytes', None)
+    if isinstance(nbytes, integer_types):
+        return nbytes
+
+    # Check for objects supporting the buffer protocol
+    try:
+        return memoryview(value).nbytes
+    except TypeError:
+        return None
+
+
+def nbytes_sizer(value):
+    """Estimates the size of a value from its data buffer.
+
+    This sizer is cheap and exact for buffer-like values (e.g. NumPy arrays,
+    bytes, or bytearrays), but does not descend into containers.  For values
+    without a buffer, the shallow size of the object is used.
+
+    Args:
+        value: The value to size
+
+    Returns:
+        The estimated size in bytes.
+    """
+    size = _buffer_size(value)
+    return sys.getsizeof(value) if size is None else size
+
+
+def recursive_sizer(value):
+    """Estimates the size of a value by recursively traversing containers and
+    object attributes.
+
+    Buffer-like values are sized by their data buffer.  Objects reachable via
+    multiple paths are only counted once.
+
+    Args:
+        value: The value to size
+
+    Returns:
+        The estimated size in bytes.
+    """
+    # Walk the object graph iteratively to avoid recursion limits
+    total = 0
+    seen = set()
+    pending = [value]
+    while pending:
+        current = pending.pop()
+
+        # Skip objects which have already been counted
+        if id(current) in seen:
+            continue
+        seen.add(id(current))
+
+        # Count buffer-like objects by their data
+        size = _buffer_size(current)
+        if size is not None:
+            total += max(size, sys.getsizeof(current))
+            continue
+
+        # Count the object itself
+        total += sys.getsizeof(current)
+
+        # Queue up anything it contains
+        if isinstance(current, dict):
+            pending.extend(current)
+            pending.extend(itervalues(current))
+        elif isinstance(current, (list, tuple, set, frozenset)):
+            pending.extend(current)
+        else:
+            attributes = getattr(current, '__dict__', None)
+            if isinstance(attributes, dict):
+                pending.append(attributes)
+            slots = getattr(type(current), '__slots__', ())
+            if isinstance(slots, string_types):
+                slots = (slots,)
+            for slot in slots:
+                if hasattr(current, slot):
+                    pending.append(getattr(current, slot))
+
+    # All done
+    return total
+
+
+# The default sizer used by byte-budgeted caches
+default_sizer = recursive_sizer
@@ -0,0 +1,397 @@
+"""Provides an in-process stand-in for a redis server, for use in tests and
+benchmarks when no redis server is available.
+
+The stand-in speaks the redis serialization protocol over TCP, so the
+real redis client library is exercised end-to-end.  It implements the subset of
+commands used by owls-cache, with redis semantics for strings, expiry, key
+scanning, and MULTI/EXEC transactions, and supports both RESP2 and RESP3
+clients.
+"""
+
+
+# System imports
+from fnmatch import fnmatchcase
+import socketserver
+import threading
+import time
+
+
+class _Error(Exception):
+    """Represents a redis error reply.
+    """
+
+
+class _Store(object):
+    """The key-value store backing the stand-in server.
+    """
+
+    def __init__(self):
+        """Initializes a new instance of the _Store class.
+        """
+        self.lock = threading.RLock()
+        self._values = {}
+        self._expiries = {}
+
+    def _live(self, key):
+        """Expires a key if its time has come.  The lock must be held.
+
+        Args:
+            key: The key
+
+        Returns:
+            True if the key exists, False otherwise.
+        """
+        expiry = self._expiries.get(key)
+        if expiry is not None and expiry <= time.time():
+            del self._values[key]
+            del self._expiries[key]
+        return key in self._values
+
+    def _get(self, key):
+        """Gets the value of a live key, or None.  The lock must be held.
+        """
+        return self._values[key] if self._live(key) else None
+
+    def _set(self, key, value, expiry = None):
+        """Sets the value and expiry time of a key.  The lock must be held.
+        """
+        self._values[key] = value
+        if expiry is None:
+            self._expiries.pop(key, None)
+        else:
+            self._expiries[key] = expiry
+
+    def _delete(self, key):
+        """Deletes a key, returning whether or not it was live.  The lock must
+        be held.
+        """
+        existed = self._live(key)
+        self._values.pop(key, None)
+        self._expiries.pop(key, None)
+        return existed
+
+    def _keys(self, pattern = b'*'):
+        """Returns the sorted live keys matching a glob-style pattern.  The
+        lock must be held.
+        """
+        pattern = pattern.decode('latin-1')
+        return sorted(k for k in list(self._values)
+                      if self._live(k) and
+                      fnmatchcase(k.decode('latin-1'), pattern))
+
+    def execute(self, command, arguments):
+        """Executes a command via the corresponding `command_*` method.
+
+        Args:
+            command: The upper-case command name, as a string
+            arguments: The list of argument byte strings
+
+        Returns:
+            The reply value.
+        """
+        handler = getattr(self, 'command_' + command.lower(), None)
+        if handler is None:
+            raise _Error('ERR unknown command \'{0}\''.format(command))
+        with self.lock:
+            return handler(*arguments)
+
+    def command_ping(self, message = None):
+        return b'PONG' if message is None else message
+
+    def command_echo(self, message):
+        return message
+
+    def command_select(self, index):
+        return 'OK'
+
+    def command_client(self, *arguments):
+        return 'OK'
+
+    def command_get(self, key):
+        return self._get(key)
+
+    def command_set(self, key, value, *options):
+        expiry = None
+        options = list(options)
+        condition = None
+        while options:
+            option = options.pop(0).upper()
+            if option == b'EX':
+                expiry = time.time() + int(options.pop(0))
+            elif option == b'PX':
+                expiry = time.time() + int(options.pop(0)) / 1000.0
+            elif option in (b'NX', b'XX'):
+                condition = option
+            else:
+                raise _Error('ERR syntax error')
+        exists = self._live(key)
+        if (condition == b'NX' and exists) or \
+                (condition == b'XX' and not exists):
+            return None
+        self._set(key, value, expiry)
+        return 'OK'
+
+    def command_setex(self, key, seconds, value):
+        self._set(key, value, time.time() + int(seconds))
+        return 'OK'
+
+    def command_mget(self, *keys):
+        return [self._get(k) for k in keys]
+
+    def command_mset(self, *arguments):
+        for key, value in zip(arguments[::2], arguments[1::2]):
+            self._set(key, value)
+        return 'OK'
+
+    def command_del(self, *keys):
+        return sum(1 for k in keys if self._delete(k))
+
+    command_unlink = command_del
+
+    def command_exists(self, *keys):
+        return sum(1 for k in keys if self._live(k))
+
+    def command_incrby(self, key, amount):
+        try:
+            value = int(self._get(key) or 0) + int(amount)
+        except ValueError:
+            raise _Error('ERR value is not an integer or out of range')
+        self._values[key] = str(value).encode('ascii')
+        return value
+
+    def command_incr(self, key):
+        return self.command_incrby(key, b'1')
+
+    def command_expire(self, key, seconds):
+        if not self._live(key):
+            return 0
+        self._expiries[key] = time.time() + int(seconds)
+        return 1
+
+    def command_pexpire(self, key, milliseconds):
+        if not self._live(key):
+            return 0
+        self._expiries[key] = time.time() + int(milliseconds) / 1000.0
+        return 1
+
+    def command_ttl(self, key):
+        if not self._live(key):
+            return -2
+        expiry = self._expiries.get(key)
+        return -1 if expiry is None else int(round(expiry - time.time()))
+
+    def command_strlen(self, key):
+        return len(self._get(key) or b'')
+
+    def command_getrange(self, key, start, end):
+        value = self._get(key) or b''
+        start, end = int(start), int(end)
+        if end < 0:
+            end += len(value)
+        return value[start:end + 1]
+
+    def command_keys(self, pattern):
+        return self._keys(pattern)
+
+    def command_scan(self, cursor, *options):
+        pattern = b'*'
+        count = 10
+        options = list(options)
+        while options:
+            option = options.pop(0).upper()
+            if option == b'MATCH':
+                pattern = options.pop(0)
+            elif option == b'COUNT':
+                count = int(options.pop(0))
+        keys = self._keys(pattern)
+        cursor = int(cursor)
+        batch = keys[cursor:cursor + count]
+        following = cursor + count if cursor + count < len(keys) else 0
+        return [str(following).encode('ascii'), batch]
+
+    def command_dbsize(self):
+        return len(self._keys())
+
+    def command_flushdb(self, *options):
+        self._values.clear()
+        self._expiries.clear()
+        return 'OK'
+
+    command_flushall = command_flushdb
+
+
+class _Handler(socketserver.StreamRequestHandler):
+    """Handles a single client connection.
+    """
+
+    def _read_command(self):
+        """Reads a command from the client.
+
+        Returns:
+            The list of command argument byte strings, or None at end of
+            stream.
+        """
+        line = self.rfile.readline()
+        if not line:
+            return None
+        if not line.startswith(b'*'):
+            # Inline command
+            return line.split()
+        arguments = []
+        for _ in range(int(line[1:])):
+            length = int(self.rfile.readline()[1:])
+            arguments.append(self.rfile.read(length + 2)[:-2])
+        return arguments
+
+    def _encode(self, reply):
+        """Encodes a reply.
+
+        Args:
+            reply: The reply value
+
+        Returns:
+            The encoded reply, as a byte string.
+        """
+        if reply is None:
+            return b'_\r\n' if self._resp3 else b'$-1\r\n'
+        elif isinstance(reply, dict):
+            if not self._resp3:
+                return self._encode([v for i in reply.items() for v in i])
+            return b'%' + str(len(reply)).encode('ascii') + b'\r\n' + \
+                b''.join(self._encode(k) + self._encode(v)
+                         for k, v in reply.items())
+        elif isinstance(reply, _Error):
+            return b'-' + str(reply).encode('utf-8') + b'\r\n'
+        elif isinstance(reply, str):
+            return b'+' + reply.encode('utf-8') + b'\r\n'
+        elif isinstance(reply, int):
+            return b':' + str(reply).encode('ascii') + b'\r\n'
+        elif isinstance(reply, bytes):
+            return b'$' + str(len(reply)).encode('ascii') + b'\r\n' + \
+                reply + b'\r\n'
+        return b'*' + str(len(reply)).encode('ascii') + b'\r\n' + \
+            b''.join(self._encode(r) for r in reply)
+
+    def _execute(self, arguments):
+        """Executes a command, capturing errors as replies.
+
+        Args:
+            arguments: The command and its arguments
+
+        Returns:
+            The reply value.
+        """
+        try:
+            return self.server.store.execute(
+                arguments[0].decode('ascii').upper(),
+                arguments[1:]
+            )
+        except _Error as e:
+            return e
+        except (TypeError, ValueError, IndexError):
+            return _Error('ERR wrong number or type of arguments')
+
+    def _hello(self, arguments):
+        """Negotiates the protocol version.
+
+        Args:
+            arguments: The HELLO command arguments
+
+        Returns:
+            The reply value.
+        """
+        if arguments:
+            version = int(arguments[0])
+            if version not in (2, 3):
+                return _Error('NOPROTO unsupported protocol version')
+            self._resp3 = version == 3
+        return {
+            b'server': b'redis',
+            b'version': b'7.0.0',
+            b'proto': 3 if self._resp3 else 2,
+            b'mode': b'standalone',
+            b'role': b'master',
+            b'modules': [],
+        }
+
+    def handle(self):
+        """Serves commands until the client disconnects.
+        """
+        self._resp3 = False
+        transaction = None
+        while True:
+            arguments = self._read_command()
+            if arguments is None:
+                return
+            if not arguments:
+                continue
+            command = arguments[0].upper()
+
+            # Handle connection-level commands and transactions
+            if command == b'HELLO':
+                reply = self._hello(arguments[1:])
+            elif command == b'MULTI':
+                transaction = []
+                reply = 'OK'
+            elif command == b'EXEC' and transaction is not None:
+                with self.server.store.lock:
+                    reply = [self._execute(a) for a in transaction]
+                transaction = None
+            elif command == b'DISCARD' and transaction is not None:
+                transaction = None
+                reply = 'OK'
+            elif command in (b'WATCH', b'UNWATCH'):
+                reply = 'OK'
+            elif transaction is not None:
+                transaction.append(arguments)
+                reply = 'QUEUED'
+            else:
+                reply = self._execute(arguments)
+
+            # Send the reply
+            self.wfile.write(self._encode(reply))
+            self.wfile.flush()
+
+
+class _Server(socketserver.ThreadingMixIn, socketserver.TCPServer):
+    """The threaded TCP server for the stand-in.
+    """
+
+    daemon_threads = True
+    allow_reuse_address = True
+
+
+class RedisStandIn(object):
+    """An in-process redis stand-in server listening on a local port.
+    """
+
+    def __init__(self):
+        """Initializes a new instance of the RedisStandIn class.
+        """
+        self._server = _Server(('127.0.0.1', 0), _Handler)
+        self._server.store = _Store()
+        self._thread = None
+
+    @property
+    def port(self):
+        """The port on which the server is listening.
+        """
+        return self._server.server_address[1]
+
+    def start(self):
+        """Starts serving on a background thread.
+
+        Returns:
+            The instance itself.
+        """
+        self._thread = threading.Thread(target = self._server.serve_forever)
+        self._thread.daemon = True
+        self._thread.start()
+        return self
+
+    def stop(self):
+        """Stops serving.
+        """
+        self._server.shutdown()
+        self._server.server_close()
+        self._thread.join()
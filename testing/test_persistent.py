@@ -1,31 +1,60 @@
 # System imports
 import unittest
 from tempfile import mkdtemp
-from os import makedirs
+from os import makedirs, environ
+from os.path import abspath, dirname
 from shutil import rmtree
+import threading
+from subprocess import check_output
+from multiprocessing import get_context
+import os
+import sys
+import time
 
 # Six imports
 from six.moves.cPickle import dumps, loads
+from six import BytesIO
 
 # owls-cache imports
 from owls_cache.persistent import cached, caching_into
+from owls_cache.persistent.keys import compute_key, key_name
+from owls_cache.persistent.__main__ import main as cli_main, parse_size
+from owls_cache.persistent.serializers import PickleSerializer, \
+    loads as serializer_loads, load as serializer_load
 from owls_cache.persistent.caches.fs import \
     FileSystemPersistentCache
-from owls_cache.persistent.caches.redis import RedisPersistentCache
+from owls_cache.persistent.caches.redis import RedisPersistentCache, \
+    shared_connection_pool
+from owls_cache.persistent.caches import PersistentCache
+from owls_cache.persistent.caches.tiered import TieredPersistentCache
+from owls_cache.persistent.caches.write_behind import \
+    WriteBehindPersistentCache
+
+# Test support imports
+from redis_standin import RedisStandIn
 
 
 # Create a filesystem backend
 fs_backend = FileSystemPersistentCache(mkdtemp())
 
 
-# Create a redis backend and add it to the list if redis is available
+# Create a redis backend, using an in-process stand-in server if redis is not
+# available on localhost:6379
 redis_backend = RedisPersistentCache(prefix = 'testing')
 redis_available = True
-redis_unavailable_message = 'redis unavailable on localhost:6379'
+redis_unavailable_message = 'redis unavailable'
 try:
     redis_backend.get('dummy')
 except:
-    redis_available = False
+    try:
+        redis_standin = RedisStandIn().start()
+        redis_backend = RedisPersistentCache(
+            port = redis_standin.port,
+            prefix = 'testing'
+        )
+        redis_backend.get('dummy')
+    except:
+        redis_available = False
 
 
 class TestPersistentBase(unittest.TestCase):
@@ -88,6 +117,437 @@ class TestFileSystemSkip(TestFileSystemBase):
         self.assertEqual(value_1, value_1_uncached)
 
 
+# A script which performs a cached computation against a file system cache and
+# prints the number of cache misses
+_cross_process_script = '''
+import sys
+from owls_cache.persistent import cached, caching_into
+from owls_cache.persistent.caches.fs import FileSystemPersistentCache
+
+misses = []
+
+@cached('cross_process')
+def concatenate(a, b, options):
+    misses.append(1)
+    return a + b
+
+with caching_into(FileSystemPersistentCache(sys.argv[1])):
+    concatenate('abc', 'def', {'x': 1, 'y': frozenset(['p', 'q'])})
+
+print(len(misses))
+'''
+
+
+def _stress_writer(path, duration):
+    # Repeatedly overwrite a single entry with large, self-consistent values
+    backend = FileSystemPersistentCache(path)
+    deadline = time.time() + duration
+    i = 0
+    while time.time() < deadline:
+        i += 1
+        backend.set('stress', (i, bytes([i % 256]) * (1 << 20)))
+
+
+def _stress_reader(path, duration, queue):
+    # Repeatedly read the entry and check that it is never torn
+    backend = FileSystemPersistentCache(path)
+    deadline = time.time() + duration
+    reads = 0
+    torn = 0
+    while time.time() < deadline:
+        value = backend.get('stress')
+        if value is None:
+            continue
+        reads += 1
+        i, payload = value
+        if len(payload) != (1 << 20) or \
+                payload.count(bytes([i % 256])) != len(payload):
+            torn += 1
+    queue.put((reads, torn))
+
+
+class TestKeyDeterminism(unittest.TestCase):
+    def test(self):
+        # Check that equivalent states map to the same key and that distinct
+        # states map to distinct keys
+        key = compute_key('f', ({'a': 1, 'b': 2}, set(['x', 'y'])))
+        self.assertEqual(
+            key,
+            compute_key('f', ({'b': 2, 'a': 1}, set(['y', 'x'])))
+        )
+        self.assertNotEqual(key, compute_key('g', ({'a': 1, 'b': 2},)))
+        self.assertNotEqual(compute_key('f', (1,)), compute_key('f', ('1',)))
+        self.assertNotEqual(compute_key('f', (1,)), compute_key('f', (True,)))
+        self.assertEqual(key_name(key), 'f')
+
+        # Check that unencodable values are rejected
+        self.assertRaises(TypeError, compute_key, 'f', (object(),))
+
+
+class TestFileSystemStatistics(TestFileSystemBase):
+    def test(self):
+        # Execute in a cached context
+        self.do_computation.statistics.reset()
+        fs_backend.statistics.reset()
+        with caching_into(fs_backend):
+            # Run a miss and a hit
+            self.do_computation(1, 2, 'add')
+            self.do_computation(1, 2, 'add')
+
+        # Check the decorator statistics
+        statistics = self.do_computation.statistics.snapshot()
+        self.assertEqual(statistics['hits'], 1)
+        self.assertEqual(statistics['misses'], 1)
+        self.assertEqual(statistics['compute']['count'], 1)
+
+        # Check the backend statistics
+        statistics = fs_backend.statistics.snapshot()
+        self.assertEqual(statistics['get']['count'], 2)
+        self.assertEqual(statistics['set']['count'], 1)
+        self.assertGreater(statistics['bytes_written'], 0)
+        self.assertEqual(statistics['bytes_read'],
+                         statistics['bytes_written'])
+
+
+class TestFileSystemLayout(TestFileSystemBase):
+    def test(self):
+        # Check that entries are stored in a two-level fan-out and that keys
+        # with path-hostile characters are safe
+        fs_backend.set('a/../b:c', 1)
+        self.assertEqual(fs_backend.get('a/../b:c'), 1)
+        entries = []
+        for directory, _, files in os.walk(fs_backend._path):
+            entries.extend(os.path.relpath(os.path.join(directory, f),
+                                           fs_backend._path)
+                           for f in files)
+        self.assertEqual(len(entries), 1)
+        self.assertEqual(len(entries[0].split(os.sep)), 3)
+
+
+class TestFileSystemConcurrency(TestFileSystemBase):
+    def test(self):
+        # Run writers and readers concurrently in separate processes
+        context = get_context('spawn')
+        queue = context.Queue()
+        processes = [
+            context.Process(target = _stress_writer,
+                            args = (fs_backend._path, 2))
+            for _ in range(2)
+        ] + [
+            context.Process(target = _stress_reader,
+                            args = (fs_backend._path, 1, queue))
+            for _ in range(3)
+        ]
+        for p in processes:
+            p.start()
+        results = [queue.get() for _ in range(3)]
+        for p in processes:
+            p.join()
+
+        # Check that there were reads and that none were torn
+        self.assertGreater(sum(r for r, _ in results), 0)
+        self.assertEqual(sum(t for _, t in results), 0)
+
+
+class TestFileSystemQuota(unittest.TestCase):
+    def setUp(self):
+        self._path = mkdtemp()
+
+    def tearDown(self):
+        rmtree(self._path)
+
+    def _count(self):
+        return sum(len(files) for _, _, files in os.walk(self._path))
+
+    def test(self):
+        # Fill a cache with an entry quota, touching the first entry so that
+        # the second is the least-recently-used one
+        backend = FileSystemPersistentCache(self._path, max_entries = 3)
+        backend.set('a', 1)
+        time.sleep(0.01)
+        backend.set('b', 2)
+        time.sleep(0.01)
+        backend.set('c', 3)
+        time.sleep(0.01)
+        backend.get('a')
+        backend.set('d', 4)
+
+        # Check that only the least-recently-used entry was evicted
+        self.assertEqual(self._count(), 3)
+        self.assertIsNone(backend.get('b'))
+        self.assertEqual(backend.get('a'), 1)
+        self.assertEqual(backend.statistics.snapshot()['evictions'], 1)
+
+        # Check that a new instance picks up the existing entries
+        backend = FileSystemPersistentCache(self._path, max_bytes = 1)
+        backend.set('e', 5)
+        self.assertEqual(self._count(), 0)
+
+
+class TestFileSystemGarbageCollection(TestFileSystemQuota):
+    def test(self):
+        # Fill an unbounded cache
+        backend = FileSystemPersistentCache(self._path)
+        for i in range(10):
+            backend.set(str(i), b'x' * 1000)
+        self.assertEqual(self._count(), 10)
+
+        # Trim it via the API and then the command line
+        removed, freed = backend.gc(max_entries = 5)
+        self.assertEqual(removed, 5)
+        self.assertGreater(freed, 5000)
+        cli_main(['gc', '--path', self._path, '--max-bytes', '2K'])
+        self.assertEqual(self._count(), 1)
+        self.assertEqual(parse_size('1.5M'), 3 << 19)
+
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+
+class TestFileSystemMemoryMap(TestFileSystemQuota):
+    def test(self):
+        # Store a multi-dimensional view and a regular value
+        backend = FileSystemPersistentCache(self._path, memory_map = True)
+        view = memoryview(bytearray(range(24))).cast('B', (2, 3, 4))
+        backend.set('view', view)
+        backend.set('other', [1, 2, 3])
+
+        # Check that the view comes back as a read-only, mapped view
+        result = backend.get('view')
+        self.assertIsInstance(result, memoryview)
+        self.assertTrue(result.readonly)
+        self.assertEqual(result.shape, (2, 3, 4))
+        self.assertEqual(result.tolist(), view.tolist())
+        self.assertEqual(backend.get('other'), [1, 2, 3])
+
+        # Check that backends without mapping enabled can read the entry
+        result = FileSystemPersistentCache(self._path).get('view')
+        self.assertEqual(result.tolist(), view.tolist())
+
+
+@unittest.skipIf(numpy is None, 'numpy unavailable')
+class TestFileSystemMemoryMapNumPy(TestFileSystemQuota):
+    def test(self):
+        # Store some arrays, including a non-contiguous one
+        backend = FileSystemPersistentCache(self._path, memory_map = True)
+        array = numpy.arange(1000, dtype = '>f8').reshape(10, 100)
+        backend.set('array', array)
+        backend.set('transposed', array.T)
+        backend.set('empty', numpy.zeros((0, 3)))
+
+        # Check that they come back as read-only arrays
+        result = backend.get('array')
+        self.assertFalse(result.flags.writeable)
+        self.assertEqual(result.dtype, array.dtype)
+        self.assertTrue((result == array).all())
+        self.assertTrue((backend.get('transposed') == array.T).all())
+        self.assertEqual(backend.get('empty').shape, (0, 3))
+
+
+class TestSerializers(unittest.TestCase):
+    def test(self):
+        # Create a value with a large buffer in it
+        value = {'data': bytearray(b'abc' * 10000), 'meta': [1, 'two', 3.0]}
+
+        # Check every combination of options, via bytes and files
+        for options in (
+            {},
+            {'protocol': 2},
+            {'out_of_band': True},
+            {'compression': 'zlib'},
+            {'compression': 'bz2', 'out_of_band': True},
+            {'compression': 'lzma', 'threshold': 0},
+        ):
+            serializer = PickleSerializer(**options)
+            data = serializer.dumps(value)
+            self.assertEqual(serializer.loads(data), value)
+            self.assertEqual(serializer_loads(data), value)
+            f = BytesIO()
+            serializer.dump(value, f)
+            self.assertEqual(f.getvalue(), data)
+            f.seek(0)
+            self.assertEqual(serializer.load(f), value)
+            if 'compression' in options:
+                self.assertLess(len(data), 30000)
+
+        # Check that plain pickles can be read
+        self.assertEqual(serializer_loads(dumps(value, protocol = 2)), value)
+        self.assertEqual(serializer_load(BytesIO(dumps(value))), value)
+
+        # Check that invalid configurations are rejected
+        self.assertRaises(ValueError, PickleSerializer, compression = 'zip')
+        self.assertRaises(ValueError, PickleSerializer,
+                          protocol = 2, out_of_band = True)
+
+
+class TestFileSystemSerializer(TestFileSystemQuota):
+    def test(self):
+        # Write an entry with a compressing serializer and read it back with
+        # the default one
+        serializer = PickleSerializer(compression = 'zlib')
+        backend = FileSystemPersistentCache(self._path, serializer = serializer)
+        backend.set('a', b'x' * 100000)
+        self.assertLess(backend.statistics.snapshot()['bytes_written'], 1000)
+        self.assertEqual(FileSystemPersistentCache(self._path).get('a'),
+                         b'x' * 100000)
+
+
+class TestFileSystemBatch(TestFileSystemBase):
+    def test(self):
+        # Execute in a cached context
+        with caching_into(fs_backend):
+            # Compute a value, then resolve a batch including it and a
+            # repeated miss
+            self.do_computation(1, 2, 'add')
+            results = self.do_computation.batch([
+                (self, 1, 2, 'add'),
+                (self, 3, 4, 'add'),
+                (self, 3, 4, 'add'),
+                (self, 3, 4, 'subtract'),
+            ])
+
+            # Check that only the distinct misses were computed and stored
+            self.assertEqual(results, [3, 7, 7, -1])
+            self.assertEqual(self._counter, 3)
+            self.do_computation(3, 4, 'subtract')
+            self.assertEqual(self._counter, 3)
+
+
+class TestFileSystemCrossProcess(TestFileSystemBase):
+    def test(self):
+        # Run the script in two interpreters with different hash seeds and
+        # check that the second one hits the cache populated by the first
+        root = dirname(dirname(abspath(__file__)))
+        misses = []
+        for seed in ('1', '2'):
+            env = dict(environ)
+            env['PYTHONHASHSEED'] = seed
+            env['PYTHONPATH'] = root
+            misses.append(int(check_output(
+                [sys.executable, '-c', _cross_process_script, fs_backend._path],
+                env = env
+            )))
+        self.assertEqual(misses, [1, 0])
+
+
+class TestTieredReadThrough(unittest.TestCase):
+    def setUp(self):
+        self._paths = [mkdtemp(), mkdtemp()]
+
+    def tearDown(self):
+        for path in self._paths:
+            rmtree(path)
+
+    def test(self):
+        # Create a memory tier over two file system tiers
+        upper, lower = [FileSystemPersistentCache(p) for p in self._paths]
+        tiered = TieredPersistentCache(upper, lower, max_entries = 2)
+
+        # Check that values found in the lowest tier are promoted
+        lower.set('a', 1)
+        self.assertEqual(tiered.get('a'), 1)
+        self.assertEqual(upper.get('a'), 1)
+        lower.statistics.reset()
+        upper.statistics.reset()
+        self.assertEqual(tiered.get_many(['a', 'b']), [1, None])
+        self.assertEqual(upper.statistics.snapshot()['hits'], 0)
+        self.assertEqual(lower.statistics.snapshot()['misses'], 1)
+
+        # Check write-through and eviction from memory
+        tiered.set_many([('b', 2), ('c', 3)])
+        self.assertEqual(lower.get_many(['b', 'c']), [2, 3])
+        self.assertEqual(tiered.statistics.snapshot()['evictions'], 1)
+        self.assertEqual(tiered.get('a'), 1)
+
+        # Check that pickled copies start with an empty memory tier
+        unpickled = loads(dumps(tiered))
+        self.assertEqual(len(unpickled._entries), 0)
+        self.assertEqual(unpickled.get('c'), 3)
+
+
+class TestTieredWriteBack(TestTieredReadThrough):
+    def test(self):
+        # Create a write-back memory tier
+        upper, lower = [FileSystemPersistentCache(p) for p in self._paths]
+        tiered = TieredPersistentCache(
+            upper,
+            lower,
+            max_entries = 2,
+            write_back = True
+        )
+
+        # Check that stores are deferred until eviction
+        tiered.set('a', 1)
+        tiered.set('b', 2)
+        self.assertEqual(lower.get('a'), None)
+        tiered.set('c', 3)
+        self.assertEqual([upper.get('a'), lower.get('a')], [1, 1])
+        self.assertEqual(lower.get('b'), None)
+
+        # Check that flushing writes the remaining deferred stores once
+        tiered.flush()
+        self.assertEqual(lower.get_many(['b', 'c']), [2, 3])
+        lower.statistics.reset()
+        tiered.flush()
+        self.assertEqual(lower.statistics.snapshot()['set']['count'], 0)
+
+
+class _GatedPersistentCache(PersistentCache):
+    # An in-memory backend whose stores block until a gate is opened
+    def __init__(self):
+        self.values = {}
+        self.stores = []
+        self.gate = threading.Event()
+
+    def set(self, key, value):
+        self.gate.wait()
+        self.stores.append(key)
+        self.values[key] = value
+
+    def get(self, key):
+        return self.values.get(key)
+
+
+class TestWriteBehind(TestPersistentBase):
+    def test(self):
+        # Create a write-behind cache over a blocked backend
+        backend = _GatedPersistentCache()
+        cache = WriteBehindPersistentCache(backend, max_pending = 2)
+
+        # Check that stores return immediately and are visible
+        cache.set('a', 1)
+        time.sleep(0.05)
+        cache.set('b', 2)
+        cache.set('b', 3)
+        self.assertEqual(cache.get_many(['a', 'b', 'c']), [1, 3, None])
+        self.assertEqual(backend.stores, [])
+
+        # Check that a full queue blocks new keys, but not queued ones
+        cache.set('c', 4)
+        blocked = threading.Thread(target = cache.set, args = ('d', 5))
+        blocked.start()
+        blocked.join(0.1)
+        self.assertTrue(blocked.is_alive())
+        cache.set('c', 6)
+
+        # Open the gate and check that stores were coalesced and flushed on
+        # exit from the caching context
+        with caching_into(cache):
+            backend.gate.set()
+            self.do_computation(1, 2, 'add')
+        blocked.join()
+        self.assertEqual(sorted(backend.stores[:4]), ['a', 'b', 'c', 'd'])
+        self.assertEqual(len(backend.stores), 5)
+        self.assertEqual(
+            [backend.values[k] for k in ('a', 'b', 'c', 'd')],
+            [1, 3, 6, 5]
+        )
+        self.assertEqual(loads(dumps(cache)).get('a'), 1)
+
+
 @unittest.skipIf(not redis_available, redis_unavailable_message)
 class TestRedisBase(TestPersistentBase):
     def tearDown(self):
@@ -105,6 +565,115 @@ class TestRedisPickle(TestRedisBase):
         self.assertEqual(unpickled.get('dummy'), None)
 
 
+@unittest.skipIf(not redis_available, redis_unavailable_message)
+class TestRedisBatch(TestRedisBase):
+    def test(self):
+        # Check batched access and that keys are prefixed
+        redis_backend.set_many([('a', 1), ('b', [2])])
+        self.assertEqual(redis_backend.get_many(['b', 'c', 'a']),
+                         [[2], None, 1])
+        self.assertEqual(redis_backend.get_many([]), [])
+        self.assertEqual(redis_backend._client.get('testing-a') is None, False)
+
+        # Check that the decorator resolves batches in a single round trip
+        with caching_into(redis_backend):
+            self.do_computation(1, 2, 'add')
+            statistics = redis_backend.statistics
+            statistics.reset()
+            results = self.do_computation.batch(
+                [(self, i, 2, 'add') for i in range(5)]
+            )
+            self.assertEqual(results, [2, 3, 4, 5, 6])
+            self.assertEqual(self._counter, 5)
+            self.assertEqual(statistics.snapshot()['get']['count'], 1)
+            self.assertEqual(statistics.snapshot()['set']['count'], 1)
+
+
+@unittest.skipIf(not redis_available, redis_unavailable_message)
+class TestRedisSharedPool(TestRedisBase):
+    def test(self):
+        # Check that instances with the same parameters share a pool, even
+        # when unpickled
+        kwargs = redis_backend._kwargs
+        first = RedisPersistentCache(shared_pool = True, **kwargs)
+        second = loads(dumps(first))
+        self.assertIs(first._client.connection_pool,
+                      second._client.connection_pool)
+        self.assertIs(first._client.connection_pool,
+                      shared_connection_pool(**kwargs))
+        first.set('shared', 1)
+        self.assertEqual(second.get('shared'), 1)
+
+
+@unittest.skipIf(not redis_available, redis_unavailable_message)
+class TestRedisInvalidation(TestRedisBase):
+    @cached('other_function', lambda s, a: (a,))
+    def do_other_computation(self, a):
+        self._counter += 1
+        return a
+
+    def test(self):
+        # Create a backend with a different prefix on the same server
+        other = RedisPersistentCache(
+            prefix = 'other',
+            **redis_backend._kwargs
+        )
+
+        # Populate both names and both prefixes
+        with caching_into(other):
+            self.do_computation(1, 2, 'add')
+        with caching_into(redis_backend):
+            self.do_computation(1, 2, 'add')
+            self.do_other_computation(1)
+            self.assertEqual(self._counter, 3)
+
+            # Invalidate a single name and check that only it misses
+            self.do_computation.invalidate()
+            self.do_computation(1, 2, 'add')
+            self.do_other_computation(1)
+            self.assertEqual(self._counter, 4)
+
+            # Invalidate the prefix and check that everything in it misses
+            redis_backend.invalidate()
+            self.do_computation(1, 2, 'add')
+            self.do_other_computation(1)
+            self.assertEqual(self._counter, 6)
+            self.do_computation(1, 2, 'add')
+            self.assertEqual(self._counter, 6)
+
+        # Check that the other prefix is unaffected
+        with caching_into(other):
+            self.do_computation(1, 2, 'add')
+        self.assertEqual(self._counter, 6)
+
+
+@unittest.skipIf(not redis_available, redis_unavailable_message)
+class TestRedisExpiry(TestRedisBase):
+    @cached('expiring_function', lambda s, a: (a,), ttl = 60)
+    def do_expiring_computation(self, a):
+        return a
+
+    def test(self):
+        # Check the decorator, per-store, and default TTLs
+        client = redis_backend._client
+        with caching_into(redis_backend):
+            self.do_expiring_computation(1)
+        key = client.keys('testing-expiring_function:*')[0]
+        self.assertTrue(0 < client.ttl(key) <= 60)
+        redis_backend.set('forever', 1)
+        self.assertEqual(client.ttl('testing-forever'), -1)
+        redis_backend.set_many({'brief': 1}, ttl = 5)
+        self.assertTrue(0 < client.ttl('testing-brief') <= 5)
+        expiring = loads(dumps(RedisPersistentCache(
+            prefix = 'testing',
+            ttl = 30,
+            **redis_backend._kwargs
+        )))
+        expiring.set('default', 1)
+        self.assertTrue(0 < client.ttl('testing-default') <= 30)
+        self.assertEqual(expiring.get('default'), 1)
+
+
 @unittest.skipIf(not redis_available, redis_unavailable_message)
 class TestRedisMiss(TestRedisBase):
     def test(self):
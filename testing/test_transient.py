@@ -1,8 +1,12 @@
 # System imports
 import unittest
+import threading
+import time
 
 # owls-cache imports
-from owls_cache.transient import cached
+from owls_cache.transient import cached, set_global_byte_budget
+from owls_cache.transient.sizing import nbytes_sizer, recursive_sizer
+from owls_cache.transient.policies import POLICIES, create_policy
 
 
 class TestTransientBase(unittest.TestCase):
@@ -64,6 +68,203 @@ class TestTransientCustom(TestTransientBase):
         self.assertEqual(value_1, value_1_cached)
 
 
+class TestTransientCoalescing(TestTransientBase):
+    @cached(lambda s, a: (a,))
+    def slow_computation(self, a):
+        self._counter += 1
+        time.sleep(0.1)
+        return a * 2
+
+    def test(self):
+        # Start many threads which all miss on the same key at once
+        results = []
+        barrier = threading.Barrier(8)
+        def worker():
+            barrier.wait()
+            results.append(self.slow_computation(21))
+        threads = [threading.Thread(target = worker) for _ in range(8)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+
+        # Check that only one of them did the work
+        self.assertEqual(self._counter, 1)
+        self.assertEqual(results, [42] * 8)
+
+
+class TestTransientFailure(TestTransientBase):
+    @cached(lambda s, a: (a,))
+    def failing_computation(self, a):
+        self._counter += 1
+        raise ValueError(a)
+
+    def test(self):
+        # Check that failures propagate and are not cached
+        self.assertRaises(ValueError, self.failing_computation, 1)
+        self.assertRaises(ValueError, self.failing_computation, 1)
+        self.assertEqual(self._counter, 2)
+
+
+class TestTransientByteBudget(TestTransientBase):
+    @cached(lambda s, n: (n,), sizer = len)
+    def make_bytes(self, n):
+        self._counter += 1
+        return b'x' * n
+
+    def tearDown(self):
+        self.make_bytes.caches.clear()
+        set_global_byte_budget(None)
+
+    def test(self):
+        # Fill a cache up to its byte budget
+        self.make_bytes(40, cache_bytes = 100, cache_size = None)
+        self.make_bytes(50, cache_bytes = 100, cache_size = None)
+        self.assertEqual(self.make_bytes.caches[''].total_bytes, 90)
+
+        # Add an entry which forces the oldest out
+        self.make_bytes(30, cache_bytes = 100, cache_size = None)
+        self.assertEqual(self.make_bytes.caches[''].total_bytes, 80)
+        self.make_bytes(50, cache_bytes = 100, cache_size = None)
+        self.assertEqual(self._counter, 3)
+        self.make_bytes(40, cache_bytes = 100, cache_size = None)
+        self.assertEqual(self._counter, 4)
+
+        # Check that oversized values are not cached
+        self.make_bytes(200, cache_bytes = 100, cache_size = None)
+        self.make_bytes(200, cache_bytes = 100, cache_size = None)
+        self.assertEqual(self._counter, 6)
+
+
+class TestTransientGlobalByteBudget(TestTransientByteBudget):
+    def test(self):
+        # Spread values across two caches under a global budget
+        set_global_byte_budget(100)
+        self.make_bytes(40, cache = 'a', cache_size = None)
+        self.make_bytes(40, cache = 'b', cache_size = None)
+        self.make_bytes(41, cache = 'a', cache_size = None)
+
+        # Check that the globally oldest entry was evicted
+        self.assertEqual(len(self.make_bytes.caches['a']), 1)
+        self.assertEqual(len(self.make_bytes.caches['b']), 1)
+        self.make_bytes(40, cache = 'b', cache_size = None)
+        self.assertEqual(self._counter, 3)
+
+
+class TestTransientSizers(unittest.TestCase):
+    def test(self):
+        # Check buffer-based sizing
+        self.assertEqual(nbytes_sizer(bytearray(1000)), 1000)
+
+        # Check that recursive sizing accounts for nested buffers once
+        payload = bytearray(1000)
+        self.assertGreater(recursive_sizer([payload, {'a': payload}]), 1000)
+        self.assertLess(recursive_sizer([payload, {'a': payload}]), 2000)
+
+
+class TestTransientPolicyConsistency(unittest.TestCase):
+    def test(self):
+        # Check that every policy only ever evicts resident keys and never
+        # loses track of them
+        for name in POLICIES:
+            policy = create_policy(name)
+            policy.capacity = 10
+            resident = set()
+            for i in range(1000):
+                key = (i * 7919) % 37
+                if key in resident:
+                    policy.access(key)
+                    continue
+                while len(resident) >= 10:
+                    victim = policy.victim(key)
+                    evicted = policy.evict(key)
+                    self.assertEqual(victim, evicted)
+                    self.assertIn(evicted, resident)
+                    resident.remove(evicted)
+                policy.insert(key)
+                resident.add(key)
+            for key in list(resident):
+                policy.remove(key)
+            self.assertIsNone(policy.victim())
+
+
+class TestTransientScanResistance(TestTransientBase):
+    def test(self):
+        # Check that frequency-aware policies keep a hot key through a scan
+        for name in ('lfu', 'arc', 'w-tinylfu'):
+            @cached(policy = name)
+            def compute(x):
+                self._counter += 1
+                return x
+            for _ in range(5):
+                compute('hot', cache_size = 4)
+            for i in range(20):
+                compute(i, cache_size = 4)
+            self._counter = 0
+            compute('hot', cache_size = 4)
+            self.assertEqual(self._counter, 0, name)
+
+
+class TestTransientNamedPolicy(TestTransientBase):
+    def test(self):
+        # Check that the policy of a named cache can be chosen at call-time
+        self.do_computation(1, 2, 'add', cache = 'lfu', cache_policy = 'lfu')
+        self.assertEqual(
+            type(self.do_computation.caches['lfu']._policy).__name__,
+            'LFUPolicy'
+        )
+        self.do_computation(1, 2, 'add')
+        self.assertEqual(
+            type(self.do_computation.caches['']._policy).__name__,
+            'LRUPolicy'
+        )
+
+
+class TestTransientStatistics(TestTransientBase):
+    def tearDown(self):
+        super(TestTransientStatistics, self).tearDown()
+        self.do_computation.statistics.reset()
+
+    def test(self):
+        # Run a miss, a hit, and an eviction
+        self.do_computation.statistics.reset()
+        self.do_computation(1, 2, 'add', cache_size = 1)
+        self.do_computation(1, 2, 'add', cache_size = 1)
+        self.do_computation(1, 2, 'subtract', cache_size = 1)
+
+        # Check the statistics
+        statistics = self.do_computation.statistics.snapshot()
+        self.assertEqual(statistics['hits'], 1)
+        self.assertEqual(statistics['misses'], 2)
+        self.assertEqual(statistics['evictions'], 1)
+        self.assertEqual(statistics['compute']['count'], 2)
+
+        # Check that they can be reset
+        self.do_computation.statistics.reset()
+        self.assertEqual(self.do_computation.statistics.snapshot()['hits'], 0)
+
+
+class TestTransientLazyLogging(TestTransientBase):
+    def test(self):
+        # Create an identifier which counts how often it is formatted
+        formatted = []
+        class Identifier(tuple):
+            def __str__(self):
+                formatted.append(1)
+                return 'identifier'
+            __repr__ = __str__
+
+        @cached(lambda a: Identifier((a,)))
+        def compute(a):
+            return a
+
+        # Check that no formatting occurs with debugging disabled
+        compute(1)
+        compute(1)
+        compute(1, cache = None)
+        self.assertEqual(formatted, [])
+
+
 # Run the tests if this is the main module
 if __name__ == '__main__':
     unittest.main()